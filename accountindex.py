@@ -0,0 +1,115 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import bisect
+
+class AmbiguousAccountError(KeyError):
+    '''Account name matches more than one account. candidates holds
+       the full paths of all of them'''
+    def __init__(self, account_name, candidates):
+        KeyError.__init__(self, account_name)
+        self.account_name = account_name
+        self.candidates = candidates
+
+    def __str__(self):
+        return "%s matches %s" % (self.account_name, ", ".join(self.candidates))
+
+class AccountIndex:
+    '''Index over the accounts of one book, built once.
+
+       Resolves account names via full path ("Assets:PayPal:USD"),
+       exact name, or - as the importers always did - a partial name
+       match, optionally restricted to an account type. Partial matches
+       are served from a sorted suffix list, so any substring is found
+       by bisection instead of a scan over all accounts.
+    '''
+    def __init__(self, entries):
+        # entries: (guid, name, type, parent guid) tuples, in document order
+        self.guids = []
+        self.names = []
+        self.types = []
+        self.by_guid = {}
+        self.by_name = {}
+        self.by_type = {}
+        parents = []
+        for index, (guid, name, acc_type, parent) in enumerate(entries):
+            self.guids.append(guid)
+            self.names.append(name)
+            self.types.append(acc_type)
+            parents.append(parent)
+            self.by_guid[guid] = index
+            self.by_name.setdefault(name, []).append(index)
+            self.by_type.setdefault(acc_type, []).append(index)
+
+        # full paths, leaving out the (unnamed in the GUI) root account
+        self.paths = []
+        self.by_path = {}
+        for index in range(len(self.guids)):
+            path = []
+            curr = index
+            while curr is not None and self.types[curr] != 'ROOT':
+                path.append(self.names[curr])
+                curr = self.by_guid.get(parents[curr])
+            path = ":".join(reversed(path))
+            self.paths.append(path)
+            self.by_path.setdefault(path, []).append(index)
+
+        # every suffix of every name, sorted - all names containing a
+        # given substring then have a suffix starting with it
+        self.suffixes = sorted((name[start:], index)
+                               for index, name in enumerate(self.names)
+                               for start in range(len(name)))
+        self.cache = {}
+        self.lookups = 0
+
+    @classmethod
+    def fromBindings(cls, accounts):
+        return cls((acc.id.value(), acc.name, acc.type,
+                    acc.parent.value() if acc.parent is not None else None)
+                   for acc in accounts)
+
+    @classmethod
+    def fromLedger(cls, accounts):
+        return cls((acc.hexGuid(), acc.name, acc.type,
+                    acc.parent.encode('hex') if acc.parent is not None else None)
+                   for acc in accounts)
+
+    # indices of all accounts whose name contains substring, in
+    # document order
+    def partialMatches(self, substring):
+        result = set()
+        pos = bisect.bisect_left(self.suffixes, (substring,))
+        while pos < len(self.suffixes) and self.suffixes[pos][0].startswith(substring):
+            result.add(self.suffixes[pos][1])
+            pos += 1
+        return sorted(result)
+
+    def byType(self, acc_type):
+        return [self.guids[index] for index in self.by_type.get(acc_type, [])]
+
+    # resolve account name (and optionally type, partial match is ok)
+    # to guid. Raises KeyError if nothing matches, AmbiguousAccountError
+    # if more than one account does
+    def lookup(self, account_name, acc_type=''):
+        self.lookups += 1
+        key = (account_name, acc_type)
+        if key in self.cache:
+            return self.cache[key]
+
+        for candidates in (self.by_path.get(account_name),
+                           self.by_name.get(account_name),
+                           self.partialMatches(account_name)):
+            if not candidates:
+                continue
+            candidates = [index for index in candidates if self.types[index].find(acc_type) != -1]
+            if len(candidates) > 1:
+                raise AmbiguousAccountError(account_name, [self.paths[index] for index in candidates])
+            if candidates:
+                self.cache[key] = self.guids[candidates[0]]
+                return self.cache[key]
+        raise KeyError(account_name)
@@ -0,0 +1,102 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+# Amounts are kept as exact (numerator, denominator) integer tuples,
+# the denominator being a power of ten - i.e. numerator is in minor
+# units, usually cents.
+
+# number formats, as (thousands separator, decimal separator)
+ENGLISH = (',', '.')   # 1,234.56 - Concardis, BitPay
+GERMAN  = ('.', ',')   # 1.234,56 - PayPal
+
+# parse decimal string into (numerator, denominator). Anything before
+# a minus sign is ignored, as the CSV exports sometimes put the
+# currency there. Denominator is at least 100
+def parseAmount(text, locale=ENGLISH):
+    thousands, decimal = locale
+    return _parseDecimal(text.replace(thousands, ''), decimal)
+
+# parseAmount, with thousands separators already removed
+def _parseDecimal(text, decimal):
+    sign = 1
+    minusIdx = text.find('-')
+    if minusIdx != -1:
+        text = text[minusIdx+1:]
+        sign = -1
+    parts = text.split(decimal)
+    if len(parts) == 1:
+        whole, fraction = parts[0], ''
+    elif len(parts) == 2:
+        whole, fraction = parts
+    else:
+        raise ValueError('Malformed amount: %s' % text)
+    whole = whole.strip() or '0'
+    fraction = fraction.strip()
+    places = max(len(fraction), 2)
+    return sign * int(whole + fraction.ljust(places, '0')), 10**places
+
+def floatFromAmount(amount):
+    return float(amount[0]) / amount[1]
+
+# float for plugins, which also remembers the exact amount it was
+# parsed from - so a value booked unchanged is written exactly, while
+# arithmetic on it falls back to plain floats (rounded to cents)
+class Amount(float):
+    '''Float parsed from a decimal string, carrying the exact
+       (numerator, denominator) tuple as .exact'''
+    def __new__(cls, exact, value=None):
+        self = float.__new__(cls, floatFromAmount(exact) if value is None else value)
+        self.exact = exact
+        return self
+
+    # pickle protocol 2 (multiprocessing) passes these to __new__
+    def __getnewargs__(self):
+        return self.exact, float(self)
+
+    def __neg__(self):
+        return Amount((-self.exact[0], self.exact[1]), -float(self))
+
+    def __abs__(self):
+        return Amount((abs(self.exact[0]), self.exact[1]), abs(float(self)))
+
+# parse decimal string into float, for plugins expecting those. Keeps
+# the sign of "-0.00", as descriptions show it
+def parseFloat(text, locale=ENGLISH):
+    thousands, decimal = locale
+    return _floatFromDecimal(text.replace(thousands, ''), decimal)
+
+def _floatFromDecimal(text, decimal):
+    amount = _parseDecimal(text, decimal)
+    if amount[0] == 0 and text.find('-') != -1:
+        return Amount(amount, -0.0)
+    return Amount(amount)
+
+# parseFloat for a whole CSV column, stripping thousands separators
+# from all of it in one go. NUL can't occur in CSV values, so it
+# separates them
+def parseAmounts(texts, locale=ENGLISH):
+    if not texts:
+        return []
+    thousands, decimal = locale
+    return [_floatFromDecimal(text, decimal) for text in '\x00'.join(texts).replace(thousands, '').split('\x00')]
+
+# negate amount - either an exact tuple, or a float
+def negateAmount(amount):
+    if isinstance(amount, tuple):
+        return -amount[0], amount[1]
+    return -amount
+
+# GnuCash "num/denom" string for an amount - exact tuples and parsed
+# Amounts are written as is, other floats (e.g. from currency
+# conversion) are rounded to cents
+def gnucashFromAmount(amount):
+    if isinstance(amount, Amount):
+        amount = amount.exact
+    if isinstance(amount, tuple):
+        return '%d/%d' % amount
+    return '%d/100' % int(round(amount * 100))
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import os, sys, csv, json, time, random, shutil, tempfile, subprocess, argparse, timeit
+import gncimport, ledger, paypal, concardis, bitpay
+
+ACCOUNT1 = '71607cde73afae2edaf31c2107319999'
+ACCOUNT2 = '00666cde73afae2edaf31c1234319999'
+
+# ledger the synthetic books grow from - has the accounts the
+# importers and test plugins book into
+SEED_LEDGER = 'gnc-testdata.xml'
+
+# directory with the scripts we time
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# format version of the JSON results
+RESULTS_VERSION = 1
+
+# stages slower than baseline by this factor count as regressions
+THRESHOLD = 1.25
+
+# PyXB stages, run in a fresh interpreter each. They print the seconds
+# spent in the part we're after, on top of the external measurement
+PARSE_SNIPPET = '''
+import sys, time, gnucash
+start = time.time()
+gnucash.CreateFromDocument(open(sys.argv[1], 'rb').read(), location_base=sys.argv[1])
+print time.time() - start
+'''
+TOXML_SNIPPET = '''
+import sys, time, gnucash
+doc = gnucash.CreateFromDocument(open(sys.argv[1], 'rb').read(), location_base=sys.argv[1])
+start = time.time()
+open(sys.argv[2], 'wb').write(doc.toxml(encoding='utf-8'))
+print time.time() - start
+'''
+WRITE_SNIPPET = '''
+import sys, time, gnucash, gncwriter
+doc = gnucash.CreateFromDocument(open(sys.argv[1], 'rb').read(), location_base=sys.argv[1])
+start = time.time()
+out = open(sys.argv[2], 'wb')
+gncwriter.writeDocument(out, doc)
+out.close()
+print time.time() - start
+'''
+BINDINGS_SNIPPET = '''
+import time, bindings
+start = time.time()
+bindings.gnucash.CreateFromDocument
+print time.time() - start
+'''
+LEAN_LOAD_SNIPPET = '''
+import sys, time, ledger
+start = time.time()
+ledger.Book.load(sys.argv[1])
+print time.time() - start
+'''
+LEAN_WRITE_SNIPPET = '''
+import sys, time, ledger
+book = ledger.Book.load(sys.argv[1])
+start = time.time()
+out = open(sys.argv[2], 'wb')
+book.write(out)
+out.close()
+print time.time() - start
+'''
+
+# time construction of count importer transactions via the factory
+# gncimport hands to importer plugins, return seconds per transaction
+def timeTransactions(splice, count):
+    createTransaction = gncimport.transactionFactory(splice)
+    def build():
+        for i in xrange(count):
+            createTransaction('2013-10-10 00:00:00 +0100', ACCOUNT1, 'Donation: Random Name',
+                              ACCOUNT2, 'PayPal: Random Name', 'EUR', (1010 + i, 100),
+                              'PayPal:Donations Random Name - ID: 0XY56000CA9123030')
+    return min(timeit.repeat(build, number=1, repeat=3)) / count
+
+# random GnuCash timestamp between 2010 and 2013
+def randomTimestamp(rand):
+    return ledger.formatTimestamp(rand.randint(1262304000, 1388534399), 60)
+
+# write synthetic book with the seed ledger's accounts plus accounts
+# more, and transactions transactions between random ones of those
+def generateBook(filename, accounts, transactions, rand):
+    book = ledger.Book.load(os.path.join(SCRIPT_DIR, SEED_LEDGER))
+    root = [account for account in book.account if account.type == 'ROOT'][0]
+    for i in xrange(accounts):
+        guid = os.urandom(16)
+        name = 'Synthetic %d' % i
+        book.account.append(ledger.Account(guid, name, 'EXPENSE', root.guid,
+            '<gnc:account version="2.0.0">\n'
+            '  <act:name>%s</act:name>\n'
+            '  <act:id type="guid">%s</act:id>\n'
+            '  <act:type>EXPENSE</act:type>\n'
+            '  <act:commodity>\n'
+            '    <cmdty:space>ISO4217</cmdty:space>\n'
+            '    <cmdty:id>EUR</cmdty:id>\n'
+            '  </act:commodity>\n'
+            '  <act:commodity-scu>100</act:commodity-scu>\n'
+            '  <act:parent type="guid">%s</act:parent>\n'
+            '</gnc:account>' % (name, ledger.hexFromGuid(guid), root.hexGuid())))
+
+    guids = [account.hexGuid() for account in book.account if account.type != 'ROOT']
+    builder = ledger.TransactionBuilder(randomTimestamp(rand))
+    for i in xrange(transactions):
+        account1, account2 = rand.sample(guids, 2)
+        value = rand.randint(1, 100000)
+        ident = '%017X' % rand.getrandbits(68)
+        book.append(builder.create('EUR', randomTimestamp(rand), 'Synthetic %d - ID: %s - generated' % (i, ident),
+                                   ((account1, 'Synthetic debit %d' % i, '%d/100' % value),
+                                    (account2, 'Synthetic credit %d' % i, '%d/100' % -value))))
+
+    out = open(filename, 'wb')
+    book.write(out)
+    out.close()
+
+def writeCSV(filename, header, rows, delimiter, quoting):
+    writer = csv.writer(open(filename, 'wb'), delimiter=delimiter, quoting=quoting, lineterminator='\n')
+    writer.writerow(header)
+    writer.writerows(rows)
+
+# cents as PayPal's German locale amount, e.g. '-12,34'
+def germanAmount(cents):
+    return '%s%d,%02d' % ('-' if cents < 0 else '', abs(cents) // 100, abs(cents) % 100)
+
+# PayPal export with rows rows: plain EUR donations, and (as per mix)
+# USD donations with their two currency conversion lines
+def generatePayPal(filename, rows, mix, rand):
+    lines = []
+    i = 0
+    while len(lines) < rows:
+        i += 1
+        date = '%02d.%02d.%d' % (rand.randint(1, 28), rand.randint(1, 12), rand.randint(2010, 2013))
+        ident = '%017X' % rand.getrandbits(68)
+        cents = rand.randint(100, 100000)
+        if rand.random() < mix:
+            converted = cents * 8 // 10
+            lines.append((date, '23:45:59', 'GMT+01:00', 'From U.S. Dollar', 'Currency Conversion', 'Completed', 'EUR',
+                          germanAmount(converted), '0,00', germanAmount(converted), '%017X' % rand.getrandbits(68), ident))
+            lines.append((date, '23:45:59', 'GMT+01:00', 'To Euro', 'Currency Conversion', 'Completed', 'USD',
+                          germanAmount(-cents), '0,00', germanAmount(-cents), '%017X' % rand.getrandbits(68), ident))
+            lines.append((date, '23:45:59', 'GMT+01:00', 'Random Name %d' % i, 'Donations', 'Completed', 'USD',
+                          germanAmount(cents), '0,00', germanAmount(cents), ident, ''))
+        else:
+            fee = cents // 30
+            lines.append((date, '23:45:59', 'GMT+01:00', 'Random Name %d' % i, 'Donations', 'Completed', 'EUR',
+                          germanAmount(cents), germanAmount(-fee), germanAmount(cents - fee), ident, ''))
+    writeCSV(filename, paypal.PROFILE.columns, lines, paypal.DELIMITER, csv.QUOTE_ALL)
+
+# Concardis export with rows rows: sales, and (as per mix) sales that
+# got reversed again
+def generateConcardis(filename, rows, mix, rand):
+    lines = []
+    i = 0
+    while len(lines) < rows:
+        i += 1
+        date = '%02d/%02d/%d' % (rand.randint(1, 28), rand.randint(1, 12), rand.randint(2010, 2013))
+        ref = 'LIBODONATE-%013x' % rand.getrandbits(52)
+        total = '%d.%02d' % (rand.randint(1, 1000), rand.randint(0, 99))
+        lines.append(('%d/0' % i, ref, date, date, '9', 'Random Name %d' % i, total, 'EUR', 'CreditCard', 'VISA',
+                      'Authorization ==> Successful completion of a sale', 'Donation to The Document Foundation'))
+        if rand.random() < mix:
+            lines.append(('%d/1' % i, ref, date, date, '7', 'Random Name %d' % i, total, 'EUR', 'CreditCard', 'VISA',
+                          'Reversal ==> Successful completion of a refund', 'Donation to The Document Foundation'))
+    writeCSV(filename, concardis.PROFILE.columns, lines, concardis.DELIMITER, csv.QUOTE_MINIMAL)
+
+# BitPay export with rows rows: sales with their fee line, and (as
+# per mix) payouts
+def generateBitPay(filename, rows, mix, rand):
+    lines = []
+    while len(lines) < rows:
+        date = '%02d/%02d/%d' % (rand.randint(1, 12), rand.randint(1, 28), rand.randint(2010, 2013))
+        ident = '%022x' % rand.getrandbits(88)
+        if rand.random() < mix:
+            lines.append((date, '11:11.11', '', 'ACH/other', 'EUR', '-%d.%02d' % (rand.randint(1, 1000), rand.randint(0, 99)),
+                          'EFT Sweep', '1.00', '', ''))
+        else:
+            lines.append((date, '11:11.11', ident, 'sale', 'EUR', '%d.%02d' % (rand.randint(1, 1000), rand.randint(0, 99)),
+                          '', '100.50', '', ''))
+            lines.append((date, '11:11.11', ident, 'fee', 'EUR', '-0.00', '', '100.50', '', ''))
+    writeCSV(filename, bitpay.PROFILE.columns, lines, bitpay.DELIMITER, csv.QUOTE_MINIMAL)
+
+class StageError(Exception):
+    pass
+
+# run command in a fresh process, return wall and cpu seconds, peak
+# RSS in kB, plus the seconds the command itself reported (if any)
+def runStage(command, stdout=None):
+    output = open(stdout, 'wb') if stdout else subprocess.PIPE
+    start = time.time()
+    process = subprocess.Popen(command, cwd=SCRIPT_DIR, stdout=output)
+    printed = process.stdout.read() if stdout is None else ''
+    pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = status
+    result = {'wall': time.time() - start, 'cpu': usage.ru_utime + usage.ru_stime, 'maxrss': usage.ru_maxrss}
+    if status != 0:
+        raise StageError('exited with status %d' % (status >> 8))
+    try:
+        result['inner'] = float(printed.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        pass
+    return result
+
+# generate inputs into workdir, return list of (stage name, command,
+# stdout file) tuples to run
+def prepareStages(workdir, args):
+    rand = random.Random(args.seed)
+    path = lambda name: os.path.join(workdir, name)
+    generateBook(path('book.xml'), args.accounts, args.transactions, rand)
+    generatePayPal(path('paypal.csv'), args.rows, args.mix, rand)
+    generateConcardis(path('concardis.csv'), args.rows, args.mix, rand)
+    generateBitPay(path('bitpay.csv'), args.rows, args.mix, rand)
+
+    python = sys.executable
+    prune = ['-a', 'PayPal', '-d', '2011-01-01..2011-12-31', '-m', r'.* - ID: (\w+) - .*']
+    stages = [
+        ('startup',        [python, 'paypal.py', '-h'], os.devnull),
+        ('load-lean',      [python, '-c', LEAN_LOAD_SNIPPET, path('book.xml')], None),
+        ('write-lean',     [python, '-c', LEAN_WRITE_SNIPPET, path('book.xml'), path('write-lean.xml')], None),
+        ('paypal-lean',    [python, 'paypal.py', '-l', '-s', 'test_paypal_donation', '-s', 'test_paypal_currency_conversion',
+                            path('book.xml'), path('paypal.csv'), path('paypal-lean.xml')], os.devnull),
+        ('concardis-lean', [python, 'concardis.py', '-l', '-s', 'test_concardis_donation',
+                            path('book.xml'), path('concardis.csv'), path('concardis-lean.xml')], os.devnull),
+        ('bitpay-lean',    [python, 'bitpay.py', '-l', path('book.xml'), path('bitpay.csv'), path('bitpay-lean.xml')], os.devnull),
+        ('prune-lean',     [python, 'prune_txn.py', '-l'] + prune + [path('book.xml'), path('prune-lean.xml')], os.devnull),
+        ('export',         [python, 'export_csv.py', '-o', path('csv'), path('book.xml'), 'all'], os.devnull) ]
+    if not args.fast_only:
+        stages += [
+            ('bindings',   [python, '-c', BINDINGS_SNIPPET], None),
+            ('parse',      [python, '-c', PARSE_SNIPPET, path('book.xml')], None),
+            ('toxml',      [python, '-c', TOXML_SNIPPET, path('book.xml'), path('toxml.xml')], None),
+            ('write',      [python, '-c', WRITE_SNIPPET, path('book.xml'), path('write.xml')], None),
+            ('paypal',     [python, 'paypal.py', '-s', 'test_paypal_donation', '-s', 'test_paypal_currency_conversion',
+                            path('book.xml'), path('paypal.csv'), path('paypal.xml')], os.devnull),
+            ('concardis',  [python, 'concardis.py', '-s', 'test_concardis_donation',
+                            path('book.xml'), path('concardis.csv'), path('concardis.xml')], os.devnull),
+            ('bitpay',     [python, 'bitpay.py', path('book.xml'), path('bitpay.csv'), path('bitpay.xml')], os.devnull),
+            ('prune',      [python, 'prune_txn.py'] + prune + [path('book.xml'), path('prune.xml')], os.devnull) ]
+    return stages
+
+# compare results against baseline ones, print table. Returns names
+# of stages slower than threshold allows
+def compareResults(results, baseline, threshold):
+    regressions = []
+    print "%-16s %10s %10s %8s %10s %10s" % ('stage', 'wall', 'baseline', 'ratio', 'maxrss', 'baseline')
+    for name, stage in sorted(results['stages'].iteritems()):
+        base = baseline['stages'].get(name)
+        if base is None or 'wall' not in stage or 'wall' not in base:
+            continue
+        ratio = stage['wall'] / base['wall'] if base['wall'] > 0 else 1.0
+        print "%-16s %10.3f %10.3f %7.2fx %10s %10s%s" % (name, stage['wall'], base['wall'], ratio,
+                                                         stage.get('maxrss', '-'), base.get('maxrss', '-'),
+                                                         '  REGRESSION' if ratio > threshold else '')
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+# main script
+def main():
+    parser = argparse.ArgumentParser(description="Time and memory-profile the hot paths on synthetic ledgers and "
+                                     "CSV exports, optionally comparing against a stored baseline")
+    parser.add_argument("-v", "--verbosity", action="count", default=0, help="Increase verbosity by one (defaults to off)")
+    parser.add_argument("-n", "--number", type=int, default=1000, help="Transactions built per round (defaults to 1000)")
+    parser.add_argument("-f", "--fast-only", action="store_true", default=False, help="Only time the fast builder and the lean "
+                                                                                      "stages, e.g. without generated bindings (defaults to off)")
+    parser.add_argument("-B", "--builder-only", action="store_true", default=False, help="Only time transaction construction, "
+                                                                                         "skip the synthetic ledger stages (defaults to off)")
+    parser.add_argument("-A", "--accounts", type=int, default=50, help="Accounts added to the synthetic book (defaults to 50)")
+    parser.add_argument("-T", "--transactions", type=int, default=5000, help="Transactions in the synthetic book (defaults to 5000)")
+    parser.add_argument("-R", "--rows", type=int, default=2000, help="Rows per synthetic CSV export (defaults to 2000)")
+    parser.add_argument("-m", "--mix", type=float, default=0.3, help="Share of CSV rows that are currency conversions, "
+                                                                     "reversals or payouts (defaults to 0.3)")
+    parser.add_argument("-S", "--seed", type=int, default=1, help="Random seed for the generators (defaults to 1)")
+    parser.add_argument("-k", "--keep", default=None, help="Generate into this directory and keep it, instead of a "
+                                                           "temporary one")
+    parser.add_argument("-o", "--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("-b", "--baseline", default=None, help="Compare against JSON results of an earlier run, fail on "
+                                                               "regressions")
+    parser.add_argument("-t", "--threshold", type=float, default=THRESHOLD, help="Slowdown factor counting as regression "
+                                                                                 "(defaults to %.2f)" % THRESHOLD)
+    args = parser.parse_args()
+
+    results = {'version': RESULTS_VERSION,
+               'config': dict((key, getattr(args, key)) for key in ('number', 'fast_only', 'accounts',
+                                                                     'transactions', 'rows', 'mix', 'seed')),
+               'stages': {}}
+
+    fast = timeTransactions(True, args.number)
+    print "fast builder:  %8.1f us/transaction" % (fast * 1e6)
+    results['stages']['builder-fast'] = {'wall': fast}
+    if not args.fast_only:
+        bindings = timeTransactions(False, args.number)
+        print "PyXB bindings: %8.1f us/transaction (%.1fx)" % (bindings * 1e6, bindings / fast)
+        results['stages']['builder'] = {'wall': bindings}
+
+    if not args.builder_only:
+        workdir = args.keep or tempfile.mkdtemp(prefix='gncbench')
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+        try:
+            if args.verbosity > 0: print "Generating synthetic ledger and CSV exports in %s" % workdir
+            for name, command, stdout in prepareStages(workdir, args):
+                try:
+                    stage = runStage(command, stdout)
+                except StageError as e:
+                    print "%-16s failed: %s" % (name, e)
+                    results['stages'][name] = {'error': str(e)}
+                    continue
+                results['stages'][name] = stage
+                print "%-16s %8.3fs wall %8.3fs cpu %8d kB peak rss%s" % (
+                    name, stage['wall'], stage['cpu'], stage['maxrss'],
+                    " (%.3fs in stage)" % stage['inner'] if 'inner' in stage else '')
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir)
+
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+
+    if args.baseline:
+        try:
+            baseline = json.load(open(args.baseline))
+        except (IOError, ValueError) as e:
+            print "Cannot read baseline %s (%s), bailing out!" % (args.baseline, e)
+            exit(1)
+        regressions = compareResults(results, baseline, args.threshold)
+        if regressions:
+            print "Stages %s regressed beyond %.2fx, bailing out!" % (', '.join(regressions), args.threshold)
+            exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sys
+from gncreader import NAMESPACES
+
+# Shared bootstrap for PyXB and the bindings it generated from the
+# GnuCash schema. Importing those takes long, and used to happen at the
+# top of every script - even for --help, lean runs never touching a
+# binding, or runs bailing out on a missing account. Scripts import the
+# stand-ins below instead:
+#
+#   from bindings import pyxb, gnucash, gnc, trn, cmdty, ts, split
+#
+# The real module is imported on first attribute access, and the
+# namespace prefixes for PyXB's own DOM output are declared once, as
+# soon as the first generated module is in.
+
+# prefixes declared for PyXB's DOM output, as GnuCash uses them
+DOM_PREFIXES = ('act', 'addr', 'bgt', 'billterm', 'book', 'bt-days', 'bt-prox', 'cd', 'cmdty', 'cust',
+                'employee', 'gnc', 'invoice', 'job', 'lot', 'order', 'owner', 'price', 'recurrence',
+                'slot', 'split', 'sx', 'taxtable', 'trn', 'ts', 'tte', 'vendor')
+
+_declared = False
+
+# declare GnuCash's namespace prefixes to PyXB, instead of the ns1,
+# ns2, ... it would make up otherwise
+def declareNamespaces():
+    global _declared
+    if _declared:
+        return
+    _declared = True
+    import pyxb.namespace, pyxb.utils.domutils
+    for prefix in DOM_PREFIXES:
+        pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(
+            pyxb.namespace.NamespaceForURI(NAMESPACES[prefix], create_if_missing=True), prefix)
+
+# import module, declaring namespaces once it's a generated one
+def load(name, generated=True):
+    module = sys.modules.get(name)
+    if module is None:
+        __import__(name)
+        module = sys.modules[name]
+    if generated:
+        declareNamespaces()
+    return module
+
+class LazyModule(object):
+    '''Stand-in for a module, importing it on first attribute access.
+       Its attributes are copied over then, so later lookups cost the
+       same as on the module itself'''
+    def __init__(self, name, generated=True):
+        self.__dict__['_lazy'] = (name, generated)
+
+    def __getattr__(self, attribute):
+        name, generated = self.__dict__['_lazy']
+        module = load(name, generated)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return '<lazy module %s>' % self.__dict__['_lazy'][0]
+
+    # whether the real module got imported already
+    def isLoaded(self):
+        return '__name__' in self.__dict__
+
+pyxb = LazyModule('pyxb', generated=False)
+gnucash = LazyModule('gnucash')
+gnc = LazyModule('gnc')
+trn = LazyModule('trn')
+cmdty = LazyModule('cmdty')
+ts = LazyModule('ts')
+split = LazyModule('split')
+cd = LazyModule('cd')
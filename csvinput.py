@@ -0,0 +1,96 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import csv, operator, multiprocessing
+from amount import parseAmounts, ENGLISH
+
+# characters removed from text columns (names) - the csv module does
+# not allow NUL, so that one separates values for bulk processing
+CONTROL_CHARS = ''.join([chr(i) for i in range(1, 32)]) + '\x7f'
+SEPARATOR = '\x00'
+
+# rows per chunk handed to one worker process
+CHUNK_ROWS = 5000
+
+class ProfileError(ValueError):
+    pass
+
+class Profile:
+    '''Columns read from one provider's CSV export, by header name
+       (ignoring surrounding blanks), in the order the provider's
+       InputLine takes them. Text columns get control characters
+       removed and are decoded into unicode, amount columns are parsed
+       into amount.Amount floats in locale's number format, optional
+       columns read as empty strings if the export lacks them
+    '''
+    def __init__(self, columns, texts=(), optional=(), amounts=(), locale=ENGLISH):
+        self.columns = columns
+        self.texts = [columns.index(column) for column in texts]
+        self.optional = set(optional)
+        self.amounts = [columns.index(column) for column in amounts]
+        self.locale = locale
+
+    # map header row to column indexes. Missing optional columns map
+    # to one past the end, where readRows puts an empty string
+    def resolve(self, header):
+        positions = dict((name.strip(), index) for index, name in enumerate(header))
+        indexes = []
+        for column in self.columns:
+            if column in positions:
+                indexes.append(positions[column])
+            elif column in self.optional:
+                indexes.append(len(header))
+            else:
+                raise ProfileError('CSV header lacks column "%s"' % column)
+        return indexes
+
+# read CSV file into a list of row tuples, as per profile
+def readRows(csvfile, profile, delimiter, quotechar='"', encoding='utf-8'):
+    reader = csv.reader(open(csvfile, 'rb'), delimiter=delimiter, quotechar=quotechar)
+    header = next(reader, None)
+    if header is None:
+        return []
+    width = len(header) + 1
+    pick = operator.itemgetter(*profile.resolve(header))
+
+    # short rows are padded, like csv.DictReader does
+    padding = [''] * width
+    rows = [pick(row + padding[len(row):]) for row in reader if row]
+    if not rows or not (profile.texts or profile.amounts):
+        return rows
+
+    # cleanse and decode text columns, and parse amount columns, in one
+    # go each
+    columns = zip(*rows)
+    for index in profile.texts:
+        text = SEPARATOR.join(columns[index]).translate(None, CONTROL_CHARS)
+        columns[index] = text.decode(encoding, 'ignore').split(SEPARATOR)
+    for index in profile.amounts:
+        columns[index] = parseAmounts(columns[index], profile.locale)
+    return zip(*columns)
+
+def _parseChunk(job):
+    factory, rows = job
+    return [factory(row) for row in rows]
+
+# turn rows into factory(row) objects, e.g. InputLine instances. With
+# jobs > 1, large files are parsed in chunks by a process pool -
+# factory then needs to be picklable, i.e. a module-level class or
+# function. Row order is kept either way
+def parseRows(factory, rows, jobs=1):
+    if jobs < 2 or len(rows) <= CHUNK_ROWS:
+        return [factory(row) for row in rows]
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        chunks = pool.map(_parseChunk, [(factory, rows[start:start+CHUNK_ROWS])
+                                        for start in xrange(0, len(rows), CHUNK_ROWS)])
+    finally:
+        pool.close()
+        pool.join()
+    return [line for chunk in chunks for line in chunk]
@@ -7,87 +7,170 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import os.path, re, datetime
-import xml.etree.ElementTree as ElemTree
-from bs4 import BeautifulSoup
-import urllib2, json
-
-# convert Eurofxref xml to dict
-def convertEurofxref2ExchangeRates(historic_exchange_rates, xml_string, verbosity):
-    tree = ElemTree.XML(xml_string)
-    for dated_entry in tree.find('.//{http://www.ecb.int/vocabulary/2002-08-01/eurofxref}Cube'):
-        date = datetime.datetime.strptime( dated_entry.attrib['time'], '%Y-%m-%d' )
-        values = {}
-        for elem in dated_entry:
-            values[elem.attrib['currency']] = elem.attrib['rate']
-            if verbosity > 1: print 'Reading from eurofxref: ', date, ': ', elem.attrib['currency'], ' ', elem.attrib['rate']
-        historic_exchange_rates[date.date()] = values
-
-# convert historic currencies via eurofxref-hist-90d.xml
-def convertHistoricCurrency(historic_exchange_rates, value, from_currency, to_currency, date, verbosity):
-    if not historic_exchange_rates:
-        path = os.getenv('HOME',default='')+'/.cache/pygnclib'
-        filename = path + '/eurofxref-hist-90d.xml'
-        # file exists, and is current?
-        content = ""
-        if not os.path.exists(filename) or datetime.date.fromtimestamp(os.path.getmtime(filename)) != datetime.date.today():
-            # nope. download/update it.
-            if verbosity > 0: print 'Downloading eurofxref'
-            if not os.path.exists(path):
-                os.mkdir(path)
-            # if ever 90 days of history is not enough,
-            # http://www.ecb.int/stats/eurofxref/eurofxref-hist.xml
-            # has the full history since the 90ties.
-            content = urllib2.urlopen('http://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist-90d.xml').read()
-            # and buffer for the next time
-            f = open(filename, "wb")
-            f.write(content)
-            f.close()
-        else:
-            # yes. just read.
-            if verbosity > 0: print 'Loading cached eurofxref'
-            f = open(filename)
-            content = f.read()
-        if verbosity > 0: print 'Parsing eurofxref'
-        convertEurofxref2ExchangeRates(historic_exchange_rates, content, verbosity)
-    if not historic_exchange_rates.has_key(date):
-        # hmm. seems they spare us the weekends - try one and two days earlier
-        date1 = datetime.date.fromordinal( date.toordinal()-1 )
-        date2 = datetime.date.fromordinal( date.toordinal()-2 )
-        if historic_exchange_rates.has_key(date1):
-            date = date1
-        elif historic_exchange_rates.has_key(date2):
-            date = date2
-    fromEUR = historic_exchange_rates[date][from_currency]
-    toEUR = 1.0
-    if to_currency != 'EUR':
-        toEUR = historic_exchange_rates[date][to_currency]
-    return value / float(fromEUR) * float(toEUR)
+import urllib2, socket, httplib
+from ratestore import RateStore
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# converter page answering ?a=1&from=XXX&to=YYY with the current rate
+GOOGLE_URL = 'https://www.google.com/finance/converter'
+
+# Rate providers. rateMany(keys) takes (from_currency, to_currency,
+# date) tuples, and returns a dict mapping those it knows to the factor
+# to multiply values with.
+
+class StoreProvider:
+    '''Historic ECB reference rates, from the local rate store'''
+    def __init__(self, rate_store):
+        self.rate_store = rate_store
+
+    def rateMany(self, keys):
+        result = {}
+        by_pair = {}
+        for from_currency, to_currency, date in keys:
+            by_pair.setdefault((from_currency, to_currency), []).append(date)
+        for (from_currency, to_currency), dates in by_pair.iteritems():
+            days = [date.toordinal() for date in dates]
+            # ECB rates are all against EUR
+            from_rates = self.rate_store.rateMany(from_currency, days)
+            to_rates = self.rate_store.rateMany(to_currency, days)
+            for date, from_rate, to_rate in zip(dates, from_rates, to_rates):
+                if from_rate == from_rate and to_rate == to_rate:
+                    result[(from_currency, to_currency, date)] = float(to_rate / from_rate)
+        return result
+
+class HTTPProvider:
+    '''Current rates, scraped from a Google-finance-like converter page
+       at base_url. Ignores the date, so use as a last resort only.
+
+       Gives up for the rest of the run on the first network error. A
+       page without a readable rate counts as a miss for that pair.
+    '''
+    def __init__(self, **kwargs):
+        self.base_url = kwargs.pop('base_url', GOOGLE_URL)
+        self.timeout = kwargs.pop('timeout', 10)
+        self.verbosity = kwargs.pop('verbosity', 0)
+        self.offline = False
+        # (from, to) -> factor, or None if the page had none
+        self.rates = {}
+
+    def fetch(self, from_currency, to_currency):
+        # only needed here, and slow to import
+        from bs4 import BeautifulSoup
+        url = '%s?a=1&from=%s&to=%s' % (self.base_url, from_currency, to_currency)
+        if self.verbosity > 0: print 'Querying %s' % url
+        tree = BeautifulSoup(urllib2.urlopen(url, timeout=self.timeout).read(), 'html.parser')
+        span = tree.find(attrs={"class": "bld"})
+        if span is None or span.string is None:
+            return None
+        try:
+            return float(span.string.split()[0])
+        except (ValueError, IndexError):
+            if self.verbosity > 0: print 'Unreadable rate from %s: %s' % (url, span.string)
+            return None
+
+    def rateMany(self, keys):
+        result = {}
+        for from_currency, to_currency, date in keys:
+            pair = (from_currency, to_currency)
+            if pair not in self.rates:
+                if self.offline:
+                    continue
+                try:
+                    self.rates[pair] = self.fetch(from_currency, to_currency)
+                except (urllib2.URLError, socket.error, httplib.HTTPException) as e:
+                    if self.verbosity > 0: print 'Failed to query %s, not trying again: %s' % (self.base_url, e)
+                    self.offline = True
+                    continue
+            if self.rates[pair] is not None:
+                result[(from_currency, to_currency, date)] = self.rates[pair]
+        return result
+
+# add --rates-url option to argparse parser, e.g. to point the
+# converter at a local stand-in server
+def addArguments(parser):
+    parser.add_argument("--rates-url", default=GOOGLE_URL, metavar="URL", help="Converter page asked for rates the local "
+                                                                               "rate store lacks (defaults to Google's)")
 
 class CurrencyConverter:
     '''Convert currencies, using various online resources.
 
-       Keep an instance of this class around to cache once-queried results
+       Rates are asked from a chain of providers (by default the local
+       ECB rate store, then Google), first hit wins. Keep an instance of
+       this class around to cache once-queried results - misses
+       included, so a pair no provider knows is only tried once.
+       base_url is the converter page the HTTP provider asks.
     '''
     def __init__(self, **kwargs):
-        self.current_exchange_rates  = {}
-        self.historic_exchange_rates = {}
         self.verbosity = kwargs.pop('verbosity')
+        self.rate_store = kwargs.pop('rate_store', None) or RateStore(verbosity=self.verbosity)
+        base_url = kwargs.pop('base_url', None) or GOOGLE_URL
+        self.providers = kwargs.pop('providers', None) or [StoreProvider(self.rate_store),
+                                                           HTTPProvider(base_url=base_url, verbosity=self.verbosity)]
+        # (from, to, date) -> factor, or None for known misses
+        self.rates = {}
+
+    # resolve (from_currency, to_currency, date) keys in one go, each
+    # provider getting what the previous ones did not know
+    def prefetch(self, keys):
+        pending = set(key for key in keys if key not in self.rates and key[0] != key[1])
+        for provider in self.providers:
+            if not pending:
+                break
+            found = provider.rateMany(pending)
+            self.rates.update(found)
+            pending.difference_update(found)
+        for key in pending:
+            if self.verbosity > 0: print 'No exchange rate from %s to %s on %s' % key
+            self.rates[key] = None
+
+    def rate(self, from_currency, to_currency, date):
+        if from_currency == to_currency:
+            return 1.0
+        key = (from_currency, to_currency, date)
+        if key not in self.rates:
+            self.prefetch([key])
+        if self.rates[key] is None:
+            raise KeyError('No exchange rate from %s to %s on %s' % key)
+        return self.rates[key]
 
     def convert(self, value, from_currency, to_currency, date):
         if from_currency == to_currency:
             return value
-        try:
-            return convertHistoricCurrency(self.historic_exchange_rates, value, from_currency, to_currency, date, self.verbosity)
-        except:
-            if self.verbosity > 0: print 'Error in convertHistoricCurrency(%s, %s, %s), falling back to google app' % (value, from_currency, date)
-            url = 'https://www.google.com/finance/converter?a=1&from=%s&to=%s' % (from_currency, to_currency)
-            if self.current_exchange_rates.has_key(url):
-                res = self.current_exchange_rates[url]
-            else:
-                tree = BeautifulSoup(urllib2.urlopen(url).read())
-                span = tree.find(attrs={"class": "bld"})
-                if span is not None:
-                    res = span.string.split()[0]
-                    self.current_exchange_rates[url] = res
-            return value * float(res)
+        return value * self.rate(from_currency, to_currency, date)
+
+    # convert whole columns at once: values with per-value currency and
+    # date, all into to_currency. Takes sequences or numpy arrays, and
+    # returns a numpy array if numpy is available, a list otherwise.
+    # Values without a locally stored rate go through the provider chain
+    def convertMany(self, values, from_currencies, to_currency, dates):
+        days = [date.toordinal() for date in dates]
+        # one column of the per-date cross rate matrix per currency,
+        # each going through EUR
+        columns = {}
+        for currency in set(from_currencies):
+            if currency != to_currency:
+                columns[currency] = self.rate_store.rateMany(currency, days)
+        to_rates = self.rate_store.rateMany(to_currency, days)
+
+        if numpy is not None:
+            values = numpy.asarray(values, dtype=numpy.float64)
+            from_currencies = numpy.asarray(from_currencies)
+            result = values.copy()
+            for currency, from_rates in columns.iteritems():
+                mask = from_currencies == currency
+                result[mask] = values[mask] * (to_rates[mask] / from_rates[mask])
+            missing = numpy.flatnonzero(numpy.isnan(result) & ~numpy.isnan(values))
+        else:
+            result = list(values)
+            for index, currency in enumerate(from_currencies):
+                if currency != to_currency:
+                    result[index] = values[index] * (to_rates[index] / columns[currency][index])
+            missing = [index for index, value in enumerate(result) if value != value]
+
+        self.prefetch((from_currencies[index], to_currency, dates[index]) for index in missing)
+        for index in missing:
+            result[index] = self.convert(values[index], from_currencies[index], to_currency, dates[index])
+        return result
@@ -0,0 +1,68 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import os, re, hashlib
+from gncreader import qname, iterBook, digestFile
+
+# provider transaction ids: PayPal ids, Concardis refs, BitPay
+# invoice ids - i.e. longish words containing at least one digit
+TOKEN = re.compile(r'(?<![\w/-])(?=[\w/-]*\d)[A-Za-z0-9][\w/-]{7,}')
+
+# where text that may carry ids lives in a transaction
+TEXT_TAGS = frozenset([qname('trn', 'num'), qname('trn', 'description'), qname('split', 'memo'),
+                       qname('slot', 'value')])
+
+# bump whenever the set of indexed tags or the stamp changes, to
+# rebuild sidecars
+FORMAT = 3
+
+class DuplicateIndex:
+    '''Set of provider transaction ids already booked in a ledger.
+
+       Built in one streaming pass over all transaction numbers,
+       descriptions, memos and slot values, and persisted as a sidecar
+       file in ~/.cache/pygnclib, which is reused as long as the
+       ledger's content hash is unchanged - mtime and size could miss
+       same-length rewrites within one second.
+    '''
+    def __init__(self, gncfile, **kwargs):
+        self.verbosity = kwargs.pop('verbosity', 0)
+        self.ids = None
+
+        stamp = "%d %s\n" % (FORMAT, digestFile(gncfile))
+        path = os.getenv('HOME', default='') + '/.cache/pygnclib'
+        sidecar = path + '/dupes-' + hashlib.sha1(os.path.abspath(gncfile)).hexdigest() + '.idx'
+
+        if os.path.exists(sidecar):
+            f = open(sidecar, 'rb')
+            if f.readline() == stamp:
+                if self.verbosity > 0: print 'Loading cached transaction id index'
+                self.ids = set(line.rstrip('\n') for line in f)
+            f.close()
+
+        if self.ids is None:
+            if self.verbosity > 0: print 'Indexing transaction ids of %s' % gncfile
+            self.ids = set()
+            for kind, elem in iterBook(gncfile, kinds=('transaction',)):
+                for child in elem.iter():
+                    if child.tag in TEXT_TAGS and child.text:
+                        self.ids.update(TOKEN.findall(child.text))
+            if not os.path.exists(path):
+                os.makedirs(path)
+            f = open(sidecar + '.tmp', 'wb')
+            f.write(stamp)
+            for ident in self.ids:
+                f.write((ident.encode('utf-8') if isinstance(ident, unicode) else ident) + '\n')
+            f.close()
+            os.rename(sidecar + '.tmp', sidecar)
+
+    def __contains__(self, ident):
+        return ident in self.ids
+
+    def __len__(self):
+        return len(self.ids)
@@ -25,8 +25,9 @@
 #   See:  http://www.gnu.org/licenses/lgpl.html
 #
 
-import sys, gzip
+import sys, os, argparse
 import xml.sax as sax
+import gncreader, instrument
 
 def init_account():
     account0 = {}.fromkeys(['name', 'id', 'type', 'description', 'parent'], '')
@@ -52,14 +53,23 @@ def eval_fraction(cont):
 
 class GCContent(sax.handler.ContentHandler):
 
-    def __init__(self, uids):
+    def __init__(self, uids, writers):
         self.account = init_account()
         self.trn = init_trn()
         self.split = init_split()
         self.splits = []
         self.tbl = ''
         self.name = ''
+        # requested accounts, in output order. None means all accounts
+        # under the book's root, in document order - not the root
+        # itself, nor the template accounts of scheduled transactions
         self.account_uids = uids
+        self.all_accounts = uids is None
+        if self.all_accounts:
+            self.account_uids = []
+        self.wanted = set(self.account_uids)
+        # account uid -> output file
+        self.writers = writers
         self.status_date_posted = False
         self.date_posted = ''
         self.status_template_trns = False
@@ -68,17 +78,21 @@ class GCContent(sax.handler.ContentHandler):
         if ':' in name:
             self.tbl = name.split(':')[0]
             self.key = name.split(':')[1]
+        if name == 'gnc:template-transactions':
+            self.status_template_trns = True
 
     def endElement(self, name):
-        def insert_statement(account, value_dict, splits):
-            for split in splits:
-                if 'account' in split and split['account'] == account:
-                    print (u'"%s\"\t\"%s-%s\"\t"%f\"\t"%s\"' % (
-                        account, value_dict['date_ym'], value_dict['date_d'], -1*split['value'], value_dict['description'])).encode('utf-8','replace')
+        def insert_statement(account, value_dict, split):
+            self.writers(account).write((u'"%s\"\t\"%s-%s\"\t"%f\"\t"%s\"\n' % (
+                account, value_dict['date_ym'], value_dict['date_d'], -1*split['value'], value_dict['description'])).encode('utf-8','replace'))
 
         if name == 'gnc:account':
             for tup in self.account.iteritems():
                 self.account[tup[0]] = tup[1].rstrip()
+            if self.all_accounts and self.status_template_trns == False and \
+                    self.account['type'] != 'ROOT' and self.account['id'] not in self.wanted:
+                self.account_uids.append(self.account['id'])
+                self.wanted.add(self.account['id'])
             self.account = init_account()
             self.tbl = ''
             self.key = ''
@@ -102,8 +116,16 @@ class GCContent(sax.handler.ContentHandler):
             for tup in self.trn.iteritems():
                 self.trn[tup[0]] = tup[1].rstrip()
             if self.status_template_trns == False:
-                for account_uid in self.account_uids:
-                    insert_statement(account_uid, self.trn, self.splits)
+                # dispatch splits by account, then emit in requested
+                # account order
+                by_account = {}
+                for split in self.splits:
+                    if split['account'] in self.wanted:
+                        by_account.setdefault(split['account'], []).append(split)
+                if by_account:
+                    for account_uid in self.account_uids:
+                        for split in by_account.get(account_uid, ()):
+                            insert_statement(account_uid, self.trn, split)
             self.trn = init_trn()
             self.splits = []
             self.tbl = ''
@@ -132,28 +154,74 @@ class GCContent(sax.handler.ContentHandler):
             if self.key == 'template-transactions':
                 self.status_template_trns = True
 
-# main script
-if len(sys.argv) > 1:
-    gcfile = sys.argv[1]
-else:
-    print "Usage: export_csv.py <gnucash_file> <account_guid>"
-    exit(1)
+# one csv per account in outdir, or everything to stdout
+class CSVWriters:
+    def __init__(self, outdir, header):
+        self.outdir = outdir
+        self.header = header
+        self.files = {}
+        if outdir is None:
+            sys.stdout.write(header)
+
+    def __call__(self, account):
+        if self.outdir is None:
+            return sys.stdout
+        out = self.files.get(account)
+        if out is None:
+            out = open(os.path.join(self.outdir, account + '.csv'), 'wb')
+            out.write(self.header)
+            self.files[account] = out
+        return out
+
+    def close(self, accounts):
+        # accounts without any splits still get their (empty) file
+        for account in accounts:
+            self(account)
+        for out in self.files.itervalues():
+            out.close()
 
-# read GnuCash Data
+# main script
+parser = argparse.ArgumentParser(description="Export splits of GnuCash accounts as CSV, in one pass over the ledger")
+parser.add_argument("-o", "--outdir", default=None, help="Write one <account_guid>.csv per account into this directory, "
+                                                         "instead of everything to stdout")
+parser.add_argument("-P", "--progress", action="store_true", default=False, help="Report bytes of the ledger read so far on "
+                                                                                  "stderr (defaults to off)")
+parser.add_argument("gnucash_file", help="GnuCash file to export from, '-' reads stdin")
+parser.add_argument("account_guid", nargs='+', help="Account(s) to export, or 'all' for every account under the book's root")
+instrument.addArguments(parser)
+args = parser.parse_args()
+instrument.setup(args)
+
+gcfile = args.gnucash_file
+
+# stream GnuCash Data, transparently gunzipping
+source = gncreader.openGnuCashFile(gcfile)
 try:
-    f = gzip.open(gcfile)
-    gcxml = f.read()
-except:
-    f = open(gcfile)
-    gcxml = f.read()
+    total = os.fstat(source.fileobj.fileno()).st_size
+except (AttributeError, OSError):
+    total = 0
 
 # quote generating statement
-print '# Generated by export_csv.py %s' % " ".join(sys.argv[1:])
-print 'AccountUID\tDate\tAmount'
-
-# parse data and print to stdout
-handler = GCContent(sys.argv[2:])
-parser = sax.make_parser()
-parser.setContentHandler(handler)
-parser.feed(gcxml)
-f.close()
+header = '# Generated by export_csv.py %s\nAccountUID\tDate\tAmount\n' % " ".join(sys.argv[1:])
+if args.outdir is not None and not os.path.exists(args.outdir):
+    os.makedirs(args.outdir)
+writers = CSVWriters(args.outdir, header)
+
+# parse data and write out
+handler = GCContent(None if args.account_guid == ['all'] else args.account_guid, writers)
+with instrument.phase('export'):
+    parser = sax.make_parser()
+    parser.setContentHandler(handler)
+    for chunk in source.chunks():
+        parser.feed(chunk)
+        if args.progress:
+            if total:
+                sys.stderr.write("\r%d of %d bytes (%d%%)" % (source.consumed, total, 100 * source.consumed / total))
+            else:
+                sys.stderr.write("\r%d bytes" % source.consumed)
+    parser.close()
+    source.close()
+    if args.progress:
+        sys.stderr.write("\n")
+    writers.close(handler.account_uids)
+instrument.count('bytes', source.consumed)
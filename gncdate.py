@@ -0,0 +1,106 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import re, datetime
+from collections import OrderedDict
+
+# timezone assumed if the input does not say
+DEFAULT_TZ = '+0100'
+
+# PayPal spells out some zones by name
+ZONE_NAMES = {
+    'GMT':  '+0000',
+    'UTC':  '+0000',
+    'CET':  '+0100',
+    'CEST': '+0200',
+    'EST':  '-0500',
+    'EDT':  '-0400',
+    'PST':  '-0800',
+    'PDT':  '-0700' }
+
+DIGITS = re.compile(r'\d+')
+GMT_OFFSET = re.compile(r'^(?:GMT|UTC)?\s*([+-])(\d{1,2}):?(\d{2})?$')
+
+# bounded LRU cache for functions of hashable arguments. Provider
+# exports have thousands of rows sharing a handful of dates
+def memoize(maxsize):
+    def decorator(func):
+        cache = OrderedDict()
+        def wrapper(*args):
+            try:
+                value = cache.pop(args)
+            except KeyError:
+                value = func(*args)
+                if len(cache) >= maxsize:
+                    cache.popitem(last=False)
+            cache[args] = value
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+class FixedOffset(datetime.tzinfo):
+    '''Timezone with a fixed offset from UTC, e.g. "+0100"'''
+    def __init__(self, name):
+        self.name = name
+        minutes = int(name[1:3])*60 + int(name[3:5])
+        self.offset = datetime.timedelta(minutes=-minutes if name[0] == '-' else minutes)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return datetime.timedelta(0)
+
+    def tzname(self, dt):
+        return self.name
+
+    def __reduce__(self):
+        return FixedOffset, (self.name,)
+
+@memoize(64)
+def timezone(name):
+    return FixedOffset(name)
+
+# map PayPal's "Time Zone" column ("GMT+01:00", "PST", ...) to a GnuCash
+# offset like "+0100". Unknown zones get DEFAULT_TZ
+@memoize(64)
+def tzFromPayPal(text):
+    text = text.strip()
+    if text in ZONE_NAMES:
+        return ZONE_NAMES[text]
+    match = GMT_OFFSET.match(text)
+    if match is None:
+        return DEFAULT_TZ
+    return '%s%02d%s' % (match.group(1), int(match.group(2)), match.group(3) or '00')
+
+# GnuCash timestamp string for datetime. Naive datetimes are taken
+# to be in DEFAULT_TZ
+def formatDate(date_value):
+    tz = date_value.tzname() or DEFAULT_TZ
+    return '%04d-%02d-%02d %02d:%02d:%02d %s' % (date_value.year, date_value.month, date_value.day,
+                                                 date_value.hour, date_value.minute, date_value.second, tz)
+
+# parse date (and time) of fixed field order into (datetime carrying
+# tz, GnuCash timestamp string). order names the numeric fields as
+# they appear, e.g. 'dmyHMS' for "31.12.2012 23:45:59", or 'mdy' for
+# "10/31/2013" - separators don't matter
+@memoize(4096)
+def parseDate(text, order, tz=DEFAULT_TZ):
+    fields = DIGITS.findall(text)
+    if len(fields) != len(order):
+        raise ValueError('Date %s does not match field order %s' % (text, order))
+    values = dict(zip(order, [int(field) for field in fields]))
+    date_value = datetime.datetime(values['y'], values['m'], values['d'],
+                                   values.get('H', 0), values.get('M', 0), values.get('S', 0),
+                                   tzinfo=timezone(tz))
+    return date_value, formatDate(date_value)
+
+# GnuCash timestamp for right now, in DEFAULT_TZ
+def now():
+    return formatDate(datetime.datetime.now())
@@ -0,0 +1,201 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import gzip, uuid
+
+from bindings import pyxb, gnucash, gnc, trn, cmdty, ts, split   # Bindings generated by PyXB, loaded on first use
+import gncreader, gncwriter, gncdate, gncvalidate, ledger, instrument, snapshot
+from accountindex import AccountIndex, AmbiguousAccountError
+from amount import gnucashFromAmount, negateAmount
+
+# resolve account name to guid via account index, bail out if there
+# is no or no unique match
+def lookupAccountUUID(account_index, account_name, acc_type=''):
+    try:
+        return account_index.lookup(account_name, acc_type)
+    except AmbiguousAccountError as e:
+        print "Ambiguous account name %s (%s) in current book, bailing out!" % (account_name, ", ".join(e.candidates))
+        exit(1)
+    except KeyError:
+        print "Did not find account with name %s in current book, bailing out!" % account_name
+        exit(1)
+
+# whether loadBook parses without PyXB validation
+_unvalidatedParse = False
+
+# turn off PyXB's validation of every binding, when parsing and
+# generating - writeBook checks the result in one go instead. Bindings
+# built from positional arguments need the content model, so binding
+# validation is only off while loadBook parses (and new transactions
+# get added via appendTransaction)
+def deferValidation():
+    global _unvalidatedParse
+    _unvalidatedParse = True
+    pyxb.RequireValidWhenGenerating(False)
+
+# add PyXB transaction binding to book. Goes to the element list
+# directly, as the book's own append() needs the content model state
+# of a validated parse, which deferValidation skips
+def appendTransaction(book, txn):
+    book.transaction.append(txn)
+
+# load ledger to import into. Returns (doc, book) - in lean mode, doc
+# is None and book a ledger.Book holding at least the accounts. With
+# cached, a current snapshot of gncfile is used instead of parsing it -
+# failing that, the complete book is loaded, so the snapshot saved of
+# the output serves any script running next (prune_txn, too)
+def loadBook(gncfile, lean, verbosity=0, cached=False):
+    if lean:
+        if cached:
+            with instrument.phase('snapshot'):
+                book = snapshot.load(gncfile, ('account',), verbosity)
+            if book is not None:
+                return None, book
+
+            if verbosity > 0: print "Reading complete gnc file, for the snapshot"
+            with instrument.phase('parse'):
+                return None, ledger.Book.load(gncfile)
+
+        if verbosity > 0: print "Reading accounts from gnc file"
+
+        # only the accounts are needed, the rest is copied over verbatim
+        with instrument.phase('parse'):
+            return None, ledger.Book.load(gncfile, kinds=('account',))
+
+    if verbosity > 0: print "Opening gnc file"
+
+    # read GnuCash data
+    with instrument.phase('read'):
+        try:
+            f = gzip.open(gncfile)
+            gncxml = f.read()
+        except:
+            f = open(gncfile)
+            gncxml = f.read()
+
+    if verbosity > 0: print "Parsing gnc file"
+
+    try:
+        with instrument.phase('parse'):
+            if _unvalidatedParse:
+                pyxb.RequireValidWhenParsing(False)
+            try:
+                doc = gnucash.CreateFromDocument(
+                    gncxml,
+                    location_base=gncfile)
+            finally:
+                pyxb.RequireValidWhenParsing(True)
+    except pyxb.UnrecognizedContentError as e:
+        print '*** ERROR validating input:'
+        print 'Unrecognized element "%s" at %s (details: %s)' % (e.content.expanded_name, e.content.location, e.details())
+    except pyxb.UnrecognizedDOMRootNodeError as e:
+        print '*** ERROR matching content:'
+        print e.details()
+    return doc, doc.book
+
+# whether new transactions get spliced into a verbatim copy of the
+# ledger (lean or append mode), instead of re-serializing all of it.
+# They need not be PyXB bindings then
+def splicing(args):
+    return args.lean or args.append
+
+# index accounts once, for name lookups
+def indexAccounts(book, lean):
+    with instrument.phase('index'):
+        account_index = AccountIndex.fromLedger(book.account) if lean else AccountIndex.fromBindings(book.account)
+    instrument.watchCache('account', lambda: account_index.lookups, lambda: len(account_index.cache))
+    return account_index
+
+# return createTransaction function for the simple two-sided
+# importer plugins, producing compact ledger transactions via the fast
+# ledger.TransactionBuilder if splicing, and PyXB bindings otherwise
+def transactionFactory(splice):
+    # enter current time as "date entered"
+    now = gncdate.now()
+    builder = ledger.TransactionBuilder(now) if splice else None
+    if builder is not None:
+        instrument.watchCache('currency', lambda: builder.created, lambda: len(builder.currencies))
+        instrument.watchCache('date', lambda: builder.created, lambda: len(builder.dates))
+        instrument.watchCache('split account', lambda: builder.splits, lambda: len(builder.accounts))
+
+    # add a simple two-sided gnucash split transaction with the given
+    # data. num ends up in trn:num, e.g. the provider's row id
+    def createTransaction(transaction_date, account1_uuid, account1_memo, account2_uuid, account2_memo,
+                          transaction_currency, transaction_value, transaction_description, num=None):
+        if builder is not None:
+            return builder.create(
+                transaction_currency, transaction_date, transaction_description,
+                [(account1_uuid, account1_memo, gnucashFromAmount(transaction_value)),
+                 (account2_uuid, account2_memo, gnucashFromAmount(negateAmount(transaction_value)))],
+                num)
+        try:
+            # create a new transaction with two splits - just lovely this
+            # pyxb design - the below is written by _just_ looking at the
+            # rng schema
+            header = [trn.id( uuid.uuid4().hex, type="guid" ),
+                      trn.currency( cmdty.space("ISO4217"), cmdty.id(transaction_currency) )]
+            if num is not None:
+                header.append(trn.num(num))
+            return gnc.transaction(
+                *header + [
+                trn.date_posted( ts.date(transaction_date) ),
+                trn.date_entered( ts.date(now) ),
+                trn.description(transaction_description),
+                trn.splits(
+                    trn.split(
+                        split.id( uuid.uuid4().hex, type="guid" ),
+                        split.memo( account1_memo ),
+                        split.reconciled_state( "n" ),
+                        split.value( gnucashFromAmount(transaction_value) ),
+                        split.quantity( gnucashFromAmount(transaction_value) ),
+                        split.account( account1_uuid, type="guid" )),
+                    trn.split(
+                        split.id( uuid.uuid4().hex, type="guid" ),
+                        split.memo( account2_memo ),
+                        split.reconciled_state( "n" ),
+                        split.value( gnucashFromAmount(negateAmount(transaction_value)) ),
+                        split.quantity( gnucashFromAmount(negateAmount(transaction_value)) ),
+                        split.account( account2_uuid, type="guid" )))],
+                version="2.0.0" )
+        except pyxb.UnrecognizedContentError as e:
+            print '*** ERROR validating input:'
+            print 'Unrecognized element "%s" at %s (details: %s)' % (e.content.expanded_name, e.content.location, e.details())
+
+    return createTransaction
+
+# write out amended ledger - either splicing the new transactions into
+# a verbatim copy of gncfile, or re-serializing the whole document. In
+# lean mode with --snapshot, book (plus the new transactions, if it's
+# complete) is saved as snapshot of outfile
+def writeBook(gncfile, outfile, doc, new_transactions, args, book=None):
+    if args.verbosity > 0: print "Writing resulting ledger"
+
+    instrument.count('transactions', len(new_transactions))
+    out = gncwriter.openOutput(outfile, args.compress)
+    if splicing(args):
+        with instrument.phase('serialize'):
+            fragments = [txn.toXml() for txn in new_transactions]
+        with instrument.phase('write'):
+            gncwriter.spliceTransactions(gncreader.openGnuCashFile(gncfile), out, fragments)
+    else:
+        with instrument.phase('write'):
+            gncwriter.writeDocument(out, doc, " " if args.pretty else None)
+    out.close()
+
+    if args.defer_validation:
+        with instrument.phase('validate'):
+            valid = gncvalidate.reportProblems(outfile, args.verbosity)
+        if not valid:
+            print "Resulting ledger %s failed validation, bailing out!" % outfile
+            exit(1)
+
+    if args.snapshot and args.lean and book is not None:
+        with instrument.phase('snapshot'):
+            if book.kinds is None:
+                book.extendSpliced(new_transactions)
+            snapshot.save(outfile, book, args.verbosity)
@@ -0,0 +1,172 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sys, zlib, hashlib
+try:
+    import xml.etree.cElementTree as ElemTree
+except ImportError:
+    import xml.etree.ElementTree as ElemTree
+
+# namespace prefixes, as used by GnuCash itself
+NAMESPACES = {
+    'gnc':        'http://www.gnucash.org/XML/gnc',
+    'act':        'http://www.gnucash.org/XML/act',
+    'book':       'http://www.gnucash.org/XML/book',
+    'cd':         'http://www.gnucash.org/XML/cd',
+    'cmdty':      'http://www.gnucash.org/XML/cmdty',
+    'price':      'http://www.gnucash.org/XML/price',
+    'slot':       'http://www.gnucash.org/XML/slot',
+    'split':      'http://www.gnucash.org/XML/split',
+    'sx':         'http://www.gnucash.org/XML/sx',
+    'trn':        'http://www.gnucash.org/XML/trn',
+    'ts':         'http://www.gnucash.org/XML/ts',
+    'fs':         'http://www.gnucash.org/XML/fs',
+    'bgt':        'http://www.gnucash.org/XML/bgt',
+    'recurrence': 'http://www.gnucash.org/XML/recurrence',
+    'lot':        'http://www.gnucash.org/XML/lot',
+    'addr':       'http://www.gnucash.org/XML/addr',
+    'owner':      'http://www.gnucash.org/XML/owner',
+    'billterm':   'http://www.gnucash.org/XML/billterm',
+    'bt-days':    'http://www.gnucash.org/XML/bt-days',
+    'bt-prox':    'http://www.gnucash.org/XML/bt-prox',
+    'cust':       'http://www.gnucash.org/XML/cust',
+    'employee':   'http://www.gnucash.org/XML/employee',
+    'entry':      'http://www.gnucash.org/XML/entry',
+    'invoice':    'http://www.gnucash.org/XML/invoice',
+    'job':        'http://www.gnucash.org/XML/job',
+    'order':      'http://www.gnucash.org/XML/order',
+    'taxtable':   'http://www.gnucash.org/XML/taxtable',
+    'tte':        'http://www.gnucash.org/XML/tte',
+    'vendor':     'http://www.gnucash.org/XML/vendor' }
+
+# size of blocks read from the underlying file
+CHUNK_SIZE = 64*1024
+
+# expand prefix:name into ElementTree's {uri}name notation
+def qname(prefix, name):
+    return '{%s}%s' % (NAMESPACES[prefix], name)
+
+GNC_BOOK = qname('gnc', 'book')
+GNC_PRICEDB = qname('gnc', 'pricedb')
+
+class GnuCashStream:
+    '''Read-only file object for plain or gzip-compressed GnuCash files.
+
+       Decompresses incrementally, so it also works on pipes (where
+       gzip.GzipFile would want to seek). consumed holds the number of
+       raw (possibly compressed) bytes read so far.
+    '''
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.consumed = 0
+        self.buffer = ""
+        self.eof = False
+        # sniff gzip magic, otherwise pass data through unchanged
+        head = self.fileobj.read(2)
+        self.consumed += len(head)
+        if head == '\x1f\x8b':
+            self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            self.buffer = self.decompressor.decompress(head)
+        else:
+            self.decompressor = None
+            self.buffer = head
+
+    def fill(self):
+        data = self.fileobj.read(CHUNK_SIZE)
+        self.consumed += len(data)
+        if not data:
+            self.eof = True
+            if self.decompressor is not None:
+                self.buffer += self.decompressor.flush()
+        elif self.decompressor is not None:
+            self.buffer += self.decompressor.decompress(data)
+        else:
+            self.buffer += data
+
+    def read(self, size=-1):
+        if size < 0:
+            while not self.eof:
+                self.fill()
+            data, self.buffer = self.buffer, ""
+            return data
+        while len(self.buffer) < size and not self.eof:
+            self.fill()
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def chunks(self):
+        while True:
+            data = self.read(CHUNK_SIZE)
+            if not data:
+                return
+            yield data
+
+    def close(self):
+        self.fileobj.close()
+
+# open GnuCash file for reading, transparently gunzipping. '-' reads
+# from stdin.
+def openGnuCashFile(filename):
+    if filename == '-':
+        return GnuCashStream(sys.stdin)
+    return GnuCashStream(open(filename, 'rb'))
+
+# sha1 hex digest of a file's raw bytes, for keying caches derived from
+# it
+def digestFile(filename):
+    digest = hashlib.sha1()
+    f = open(filename, 'rb')
+    while True:
+        chunk = f.read(1024*1024)
+        if not chunk:
+            break
+        digest.update(chunk)
+    f.close()
+    return digest.hexdigest()
+
+# walk gnc:book incrementally, yielding (kind, element) for each
+# direct child of the book (kind is the element's local name,
+# e.g. 'account' or 'transaction'), plus each price of the pricedb
+# individually, followed by the emptied pricedb itself ('price' kinds
+# get both). Elements are discarded once the consumer asks for the
+# next one, so copy out what you need. Pass kinds to only get some of
+# them - the rest is skipped without being handed out.
+def iterBook(source, kinds=None):
+    if isinstance(source, basestring):
+        source = openGnuCashFile(source)
+    book = None
+    pricedb = None
+    depth = 0
+    for event, elem in ElemTree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 2 and elem.tag == GNC_BOOK:
+                book = elem
+            elif depth == 3 and elem.tag == GNC_PRICEDB and book is not None:
+                pricedb = elem
+            continue
+
+        depth -= 1
+        if depth == 3 and pricedb is not None:
+            # single price, child of the pricedb
+            if kinds is None or 'price' in kinds:
+                yield 'price', elem
+            pricedb.remove(elem)
+        elif depth == 2 and book is not None:
+            if elem is pricedb:
+                # hand out the (now empty) pricedb, too, for its attributes
+                if kinds is None or 'price' in kinds:
+                    yield 'pricedb', elem
+                pricedb = None
+            else:
+                kind = elem.tag.split('}')[-1]
+                if kinds is None or kind in kinds:
+                    yield kind, elem
+            book.remove(elem)
+        elif depth == 1 and elem is book:
+            book = None
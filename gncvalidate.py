@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sys, re, binascii, argparse
+import xml.parsers.expat
+import instrument
+from gncreader import openGnuCashFile
+from gncwriter import PREFIXES
+
+# Streaming structural checker for GnuCash xml files, as a fast
+# one-pass alternative to PyXB's validation of every single binding.
+# Follows gnucash-v2.rnc for the parts GnuCash needs to make sense of
+# a ledger - book layout, accounts, transactions and splits, and the
+# guids, amounts and timestamps therein - and checks that splits only
+# reference existing accounts, and transaction guids are unique.
+# Everything else (slots, scheduled transactions, business objects)
+# only needs to be well-formed.
+
+# content models of checked elements: child element names in order,
+# each optionally followed by ?, * or +
+MODELS = {
+    'gnc-v2':                 'gnc:count-data gnc:book',
+    'gnc:book':               'book:id book:slots? gnc:count-data* gnc:commodity* gnc:pricedb? gnc:account* '
+                              'gnc:transaction* gnc:template-transactions* gnc:schedxaction* gnc:budget* '
+                              'gnc:GncBillTerm* gnc:GncCustomer* gnc:GncEmployee* gnc:GncEntry* gnc:GncInvoice* '
+                              'gnc:GncJob* gnc:GncOrder* gnc:GncTaxTable* gnc:GncVendor*',
+    'gnc:account':            'act:name act:id act:type act:commodity? act:commodity-scu? act:non-standard-scu? '
+                              'act:code? act:description? act:slots? act:parent? act:lots?',
+    'gnc:transaction':        'trn:id trn:currency trn:num? trn:date-posted trn:date-entered trn:description? '
+                              'trn:slots? trn:splits',
+    'trn:currency':           'cmdty:space cmdty:id',
+    'trn:date-posted':        'ts:date ts:ns?',
+    'trn:date-entered':       'ts:date ts:ns?',
+    'trn:splits':             'trn:split+',
+    'trn:split':              'split:id split:memo? split:action? split:reconciled-state split:reconcile-date? '
+                              'split:value split:quantity split:account split:lot? split:slots?',
+    'split:reconcile-date':   'ts:date ts:ns?' }
+
+GUID = r'[0-9a-f]{32}'
+NUMERIC = r'-?[0-9]+/-?[0-9]+'
+TIMESTAMP = r'[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2} [+-][0-9]{4}'
+
+# patterns for the text content of checked elements
+TEXTS = {
+    'book:id':                GUID,
+    'act:id':                 GUID,
+    'act:parent':             GUID,
+    'act:type':               r'NONE|BANK|CASH|CREDIT|ASSET|LIABILITY|STOCK|MUTUAL|CURRENCY|INCOME|EXPENSE|EQUITY|'
+                              r'RECEIVABLE|PAYABLE|ROOT|TRADING|CHECKING|SAVINGS|MONEYMRKT|CREDITLINE',
+    'trn:id':                 GUID,
+    'split:id':               GUID,
+    'split:account':          GUID,
+    'split:lot':              GUID,
+    'split:reconciled-state': r'[ynfcv]',
+    'split:value':            NUMERIC,
+    'split:quantity':         NUMERIC,
+    'ts:date':                TIMESTAMP,
+    'gnc:count-data':         r'[0-9]+' }
+
+# required attribute values of checked elements
+ATTRIBUTES = {
+    'gnc:book':               (('version', '2.0.0'),),
+    'gnc:account':            (('version', '2.0.0'),),
+    'gnc:transaction':        (('version', '2.0.0'),),
+    'book:id':                (('type', 'guid'),),
+    'act:id':                 (('type', 'guid'),),
+    'act:parent':             (('type', 'guid'),),
+    'trn:id':                 (('type', 'guid'),),
+    'split:id':               (('type', 'guid'),),
+    'split:account':          (('type', 'guid'),),
+    'split:lot':              (('type', 'guid'),) }
+
+# model 'a b? c*' -> regex matching 'a b c c ' (child names, each
+# followed by a blank)
+def compileModel(model):
+    parts = []
+    for token in model.split():
+        if token[-1] in '?*+':
+            parts.append('(?:%s )%s' % (re.escape(token[:-1]), token[-1]))
+        else:
+            parts.append('(?:%s )' % re.escape(token))
+    return re.compile(''.join(parts) + r'\Z')
+
+COMPILED_MODELS = dict((name, compileModel(model)) for name, model in MODELS.iteritems())
+COMPILED_TEXTS = dict((name, re.compile('(?:%s)\Z' % pattern)) for name, pattern in TEXTS.iteritems())
+
+# expat's 'uri name' -> GnuCash's prefix:name
+def prefixedName(tag):
+    uri, sep, name = tag.rpartition(' ')
+    if not sep:
+        return tag
+    return PREFIXES.get(uri, uri) + ':' + name
+
+class Checker:
+    '''Collects problems of one GnuCash file, as (line, message)
+       tuples, while expat walks it'''
+    def __init__(self):
+        self.problems = []
+        # open elements, as [name, child names, text parts, line]
+        self.stack = []
+        self.accounts = set()
+        self.transactions = set()
+        # split:account references, as (line, guid)
+        self.references = []
+        self.parser = xml.parsers.expat.ParserCreate(namespace_separator=' ')
+        self.parser.StartElementHandler = self.startElement
+        self.parser.EndElementHandler = self.endElement
+        self.parser.CharacterDataHandler = self.characters
+        self.parser.buffer_text = True
+
+    def problem(self, line, message):
+        self.problems.append((line, message))
+
+    def startElement(self, tag, attrs):
+        name = prefixedName(tag)
+        line = self.parser.CurrentLineNumber
+        if self.stack and self.stack[-1][1] is not None:
+            self.stack[-1][1].append(name)
+        for attribute, value in ATTRIBUTES.get(name, ()):
+            if attrs.get(attribute) != value:
+                self.problem(line, '%s lacks %s="%s"' % (name, attribute, value))
+        self.stack.append([name,
+                           [] if name in COMPILED_MODELS else None,
+                           [] if name in COMPILED_TEXTS else None,
+                           line])
+
+    def endElement(self, tag):
+        name, children, text, line = self.stack.pop()
+        if children is not None:
+            if not COMPILED_MODELS[name].match(''.join([child + ' ' for child in children])):
+                self.problem(line, '%s has unexpected content (%s), expected %s' % (
+                    name, ', '.join(children) or 'nothing', MODELS[name]))
+        if text is not None:
+            value = ''.join(text).strip()
+            if not COMPILED_TEXTS[name].match(value):
+                self.problem(line, 'Malformed %s "%s"' % (name, value))
+            elif name == 'act:id':
+                self.accounts.add(binascii.unhexlify(value))
+            elif name == 'split:account':
+                self.references.append((line, value))
+            elif name == 'trn:id':
+                guid = binascii.unhexlify(value)
+                if guid in self.transactions:
+                    self.problem(line, 'Duplicate transaction id %s' % value)
+                self.transactions.add(guid)
+
+    def characters(self, content):
+        if self.stack and self.stack[-1][2] is not None:
+            self.stack[-1][2].append(content)
+
+    # feed one chunk of the file
+    def feed(self, data, final=False):
+        try:
+            self.parser.Parse(data, final)
+        except xml.parsers.expat.ExpatError as e:
+            self.problem(e.lineno, 'Not well-formed xml: %s' % xml.parsers.expat.ErrorString(e.code))
+            return False
+        return True
+
+    # check references, once all accounts are known
+    def finish(self):
+        for line, value in self.references:
+            if binascii.unhexlify(value) not in self.accounts:
+                self.problem(line, 'Split references unknown account %s' % value)
+        self.references = []
+        return sorted(self.problems)
+
+# check GnuCash file (plain or gzipped, '-' for stdin), return list of
+# (line, message) problems - empty if all is well
+def checkFile(filename):
+    checker = Checker()
+    source = openGnuCashFile(filename)
+    for chunk in source.chunks():
+        if not checker.feed(chunk):
+            return checker.problems
+    if checker.feed('', True):
+        return checker.finish()
+    return checker.problems
+
+# check file, print problems. Returns False if there were any
+def reportProblems(filename, verbosity=0):
+    if verbosity > 0: print "Validating %s" % filename
+    problems = checkFile(filename)
+    for line, message in problems:
+        print "%s:%d: %s" % (filename, line, message)
+    return not problems
+
+# main script
+def main():
+    parser = argparse.ArgumentParser(description="Check GnuCash xml files for structural problems, in one fast pass")
+    parser.add_argument("-v", "--verbosity", action="count", default=0, help="Increase verbosity by one (defaults to off)")
+    parser.add_argument("gnucash_file", nargs='+', help="GnuCash file(s) to check, '-' for stdin")
+    instrument.addArguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    ok = True
+    for gncfile in args.gnucash_file:
+        with instrument.phase('validate'):
+            ok = reportProblems(gncfile, args.verbosity) and ok
+    exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import re, gzip
+import xml.dom
+from gncreader import NAMESPACES
+from bindings import LazyModule, pyxb
+
+basis = LazyModule('pyxb.binding.basis', generated=False)
+
+# transaction counter in the book header
+TXN_COUNT = re.compile(r'(<gnc:count-data\s+cd:type=["\']transaction["\']\s*>)\s*(\d+)\s*(</gnc:count-data>)')
+# end of book header, i.e. first book content after book:id, slots
+# and count-data
+HEADER_END = re.compile(r'<gnc:(?!count-data\b|book\b)[\w-]+[\s/>]|</gnc:book\s*>')
+# elements that need to stay behind the transactions, as per schema
+TXN_END = re.compile(r'<gnc:(template-transactions|schedxaction|budget|Gnc\w+)[\s/>]|</gnc:book\s*>')
+# longest partial match we may need to carry over chunk boundaries
+OVERLAP = 64
+
+# namespace uri -> GnuCash prefix, for serializing ElementTree content
+PREFIXES = dict((uri, prefix) for prefix, uri in NAMESPACES.iteritems())
+
+# output collected before handing it to the file (or compressor)
+WRITE_BUFFER = 64*1024
+
+XSI = 'http://www.w3.org/2001/XMLSchema-instance'
+
+# xml-escape text content, return utf-8 encoded
+def escapeText(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def escapeAttribute(text):
+    return escapeText(text).replace('"', '&quot;')
+
+# map ElementTree's {uri}name back to prefix:name
+def prefixedName(tag):
+    if tag[0] == '{':
+        uri, name = tag[1:].split('}', 1)
+        return PREFIXES[uri] + ':' + name
+    return tag
+
+# serialize ElementTree element into an xml fragment, keeping the
+# original whitespace, and without namespace declarations (the
+# enclosing gnc-v2 element has them all)
+def elementToXml(elem):
+    parts = []
+    def serialize(elem):
+        name = prefixedName(elem.tag)
+        parts.append('<' + name)
+        for key, value in elem.items():
+            parts.append(' %s="%s"' % (prefixedName(key), escapeAttribute(value)))
+        if elem.text or len(elem):
+            parts.append('>')
+            if elem.text:
+                parts.append(escapeText(elem.text))
+            for child in elem:
+                serialize(child)
+                if child.tail:
+                    parts.append(escapeText(child.tail))
+            parts.append('</%s>' % name)
+        else:
+            parts.append('/>')
+    serialize(elem)
+    return ''.join(parts)
+
+# serialize PyXB transaction binding into an xml fragment, without
+# namespace declarations (the enclosing gnc-v2 element has them all)
+def transactionToXml(txn, pretty=False):
+    elem = txn.toDOM().documentElement
+    for name in list(elem.attributes.keys()):
+        if name.startswith('xmlns'):
+            elem.removeAttribute(name)
+    if pretty:
+        return elem.toprettyxml(indent=" ", encoding='utf-8')
+    return elem.toxml('utf-8') + "\n"
+
+# rewrite transaction counter in book header, or add one if the book
+# had no transactions so far
+def fixupHeader(header, added):
+    book_start = header.find('<gnc:book')
+    match = TXN_COUNT.search(header, book_start)
+    if match is not None:
+        count = int(match.group(2)) + added
+        return header[:match.start(2)] + str(count) + header[match.end(2):]
+    counter = '<gnc:count-data cd:type="transaction">%d</gnc:count-data>\n' % added
+    for anchor in ('</gnc:count-data>', '</book:slots>', '</book:id>'):
+        pos = header.rfind(anchor)
+        if pos >= book_start:
+            pos += len(anchor)
+            if header.startswith('\n', pos):
+                pos += 1
+            else:
+                counter = '\n' + counter
+            return header[:pos] + counter + header[pos:]
+    raise ValueError('No book id found in ledger header')
+
+# copy GnuCash ledger byte-by-byte from source (a file object, see
+# gncreader.openGnuCashFile) to out, splicing the given transaction
+# xml fragments in behind the last existing transaction, and bumping
+# the transaction counter accordingly
+def spliceTransactions(source, out, fragments):
+    # read up to and including the end of the book header
+    buf = ""
+    while True:
+        chunk = source.read(64*1024)
+        buf += chunk
+        book_start = buf.find('<gnc:book')
+        header_end = HEADER_END.search(buf, book_start) if book_start != -1 else None
+        if header_end is not None:
+            break
+        if not chunk:
+            raise ValueError('Ledger ends before the book header does')
+
+    header_len = header_end.start()
+    out.write(fixupHeader(buf[:header_len], len(fragments)))
+    buf = buf[header_len:]
+
+    # copy book content, until we're past the existing transactions
+    while True:
+        match = TXN_END.search(buf)
+        if match is not None:
+            break
+        chunk = source.read(64*1024)
+        if not chunk:
+            raise ValueError('Ledger lacks closing gnc:book')
+        # hold back enough to match element names across chunks
+        keep = min(len(buf), OVERLAP)
+        out.write(buf[:len(buf)-keep])
+        buf = buf[len(buf)-keep:] + chunk
+
+    out.write(buf[:match.start()])
+    for fragment in fragments:
+        out.write(fragment)
+    out.write(buf[match.start():])
+
+    # and the rest verbatim
+    while True:
+        chunk = source.read(64*1024)
+        if not chunk:
+            break
+        out.write(chunk)
+
+# open output file for writing, gzip-compressed at level (1 fastest,
+# 9 smallest) if given - GnuCash reads both
+def openOutput(filename, level=None):
+    if level:
+        return gzip.GzipFile(filename, 'wb', level)
+    return open(filename, 'wb')
+
+class BindingWriter:
+    '''Serializes PyXB bindings straight to out while walking them,
+       instead of building a DOM tree and a document string first, so
+       memory use does not grow with the book. indent is the string
+       nested elements get indented with, None writes no whitespace
+       at all (like toxml)'''
+    def __init__(self, out, indent=None):
+        self.out = out
+        self.indent = indent
+        self.newline = '' if indent is None else '\n'
+        self.parts = []
+        self.size = 0
+        # ExpandedName -> prefix:name
+        self.names = {}
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+        if self.size >= WRITE_BUFFER:
+            self.flush()
+
+    def flush(self):
+        self.out.write(''.join(self.parts))
+        self.parts = []
+        self.size = 0
+
+    def tagName(self, name):
+        tag = self.names.get(name)
+        if tag is None:
+            uri = name.namespaceURI()
+            local = name.localName().encode('utf-8')
+            tag = self.names[name] = local if uri is None else PREFIXES[uri] + ':' + local
+        return tag
+
+    # xml text for simple value, unescaped
+    def text(self, value):
+        if isinstance(value, basis.STD_list):
+            return ' '.join([self.text(item) for item in value])
+        if isinstance(value, basis.simpleTypeDefinition):
+            return value.xsdLiteral()
+        return unicode(value)
+
+    def attributes(self, value):
+        parts = []
+        if value._isNil():
+            parts.append(' xsi:nil="true" xmlns:xsi="%s"' % XSI)
+        if isinstance(value, basis.complexTypeDefinition):
+            for use in value._AttributeMap.itervalues():
+                if use.provided(value) and use.value(value) is not None:
+                    parts.append(' %s="%s"' % (self.tagName(use.name()), escapeAttribute(self.text(use.value(value)))))
+            for name, attribute in (value.wildcardAttributeMap() or {}).iteritems():
+                parts.append(' %s="%s"' % (self.tagName(name), escapeAttribute(self.text(attribute))))
+        return ''.join(parts)
+
+    # child element / text content of complex binding. With validation,
+    # in schema order. Without, in the order content was added (parsed,
+    # passed to the constructor or appended) - minus children removed
+    # from their element lists since, plus children added to the lists
+    # or assigned directly. That's what orderedContent() lacks, and running the
+    # content model automaton for it would defeat deferred validation
+    def children(self, value):
+        if pyxb.GlobalValidationConfig.forDocument:
+            return value._validatedChildren()
+        current = {}
+        for use in value._ElementMap.itervalues():
+            child = use.value(value)
+            if child is None:
+                continue
+            for item in (child if use.isPlural() else (child,)):
+                current[id(item)] = use
+        order = []
+        # element use -> index in order behind its last child
+        behind = {}
+        for content in value.orderedContent():
+            if isinstance(content, basis.ElementContent) and content.elementDeclaration is not None:
+                use = current.pop(id(content.value), None)
+                if use is None:
+                    continue
+                behind[use] = len(order) + 1
+            order.append(content)
+        if not current:
+            return order
+        # the rest goes behind its siblings (like transactions appended
+        # to the book's list), or to the end
+        for use in value._ElementMap.itervalues():
+            child = use.value(value)
+            if child is None:
+                continue
+            missing = [basis.ElementContent(item, use) for item in (child if use.isPlural() else (child,))
+                       if id(item) in current]
+            if not missing:
+                continue
+            pos = behind.get(use)
+            if pos is None:
+                order.extend(missing)
+                continue
+            order[pos:pos] = missing
+            for other, index in behind.iteritems():
+                if index >= pos:
+                    behind[other] = index + len(missing)
+        return order
+
+    def writeElement(self, name, value, depth, extra=''):
+        pad = '' if self.indent is None else self.indent * depth
+        tag = self.tagName(name)
+        if isinstance(value, basestring):
+            self.write('%s<%s%s>%s</%s>%s' % (pad, tag, extra, escapeText(value), tag, self.newline))
+            return
+
+        start = '%s<%s%s%s' % (pad, tag, extra, self.attributes(value))
+        if value._isNil():
+            self.write(start + '/>' + self.newline)
+        elif isinstance(value, basis.simpleTypeDefinition):
+            self.write('%s>%s</%s>%s' % (start, escapeText(self.text(value)), tag, self.newline))
+        elif value._ContentTypeTag == value._CT_EMPTY:
+            self.write(start + '/>' + self.newline)
+        elif value._ContentTypeTag == value._CT_SIMPLE:
+            self.write('%s>%s</%s>%s' % (start, escapeText(self.text(value.value())), tag, self.newline))
+        else:
+            children = self.children(value)
+            if not children:
+                self.write(start + '/>' + self.newline)
+                return
+            self.write(start + '>' + self.newline)
+            for content in children:
+                if isinstance(content, basis.NonElementContent):
+                    self.write(escapeText(content.value))
+                elif content.elementDeclaration is not None:
+                    self.writeElement(content.elementDeclaration.name(), content.value, depth + 1)
+                elif isinstance(content.value, xml.dom.Node):
+                    self.write(content.value.toxml('utf-8'))
+                else:
+                    self.write(content.value.toDOM().documentElement.toxml('utf-8'))
+            self.write('%s</%s>%s' % (pad, tag, self.newline))
+
+    # write whole document, declaring all GnuCash namespaces up front
+    def writeDocument(self, doc):
+        self.write('<?xml version="1.0" encoding="utf-8"?>\n')
+        namespaces = ''.join([' xmlns:%s="%s"' % (prefix, NAMESPACES[prefix]) for prefix in sorted(NAMESPACES)])
+        self.writeElement(doc._element().name(), doc, 0, namespaces)
+        if self.indent is None:
+            self.write('\n')
+        self.flush()
+
+# write PyXB document binding to out, see BindingWriter
+def writeDocument(out, doc, indent=None):
+    BindingWriter(out, indent).writeDocument(doc)
@@ -0,0 +1,197 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import os, sys, time, json, resource, atexit
+from contextlib import contextmanager
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Per-phase timing and memory instrumentation, shared by all scripts.
+# Code marks its phases with
+#
+#   with instrument.phase('parse'):
+#       ...
+#
+# and bumps counters via instrument.count(). All of that is a no-op
+# unless a script called instrument.setup() with --report, --profile
+# or -v given, so the hot paths pay nothing by default. Caches register
+# callables via instrument.watchCache(), evaluated only for the report.
+
+# format version of the JSON report
+REPORT_VERSION = 1
+
+def _peakRSS():
+    # kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _cpuTime():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+# importer calling through to importer, adding calls and seconds to
+# totals
+def _timedImporter(importer, totals):
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return importer(*args, **kwargs)
+        finally:
+            totals[0] += 1
+            totals[1] += time.time() - start
+    timed.totals = totals
+    return timed
+
+class Recorder:
+    '''Collects phases (wall and cpu seconds, peak RSS, traced memory
+       if tracemalloc is around), counters, cache statistics and
+       plugin handler times of one run'''
+    def __init__(self, trace_memory=False):
+        self.start = time.time()
+        self.tracing = trace_memory and tracemalloc is not None
+        # name -> {'calls', 'wall', 'cpu', 'maxrss'[, 'traced_peak']},
+        # plus names in order of first appearance
+        self.phases = {}
+        self.order = []
+        self.counters = {}
+        # name -> (lookups callable, misses callable)
+        self.caches = {}
+        # handler name -> [calls, seconds]
+        self.handlers = {}
+        if self.tracing and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.time()
+        cpu = _cpuTime()
+        try:
+            yield
+        finally:
+            entry = self.phases.get(name)
+            if entry is None:
+                entry = self.phases[name] = {'calls': 0, 'wall': 0.0, 'cpu': 0.0}
+                self.order.append(name)
+            entry['calls'] += 1
+            entry['wall'] += time.time() - wall
+            entry['cpu'] += _cpuTime() - cpu
+            entry['maxrss'] = _peakRSS()
+            if self.tracing:
+                entry['traced_peak'] = tracemalloc.get_traced_memory()[1]
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def watchCache(self, name, lookups, misses):
+        self.caches[name] = (lookups, misses)
+
+    # wrap importer functions of plugins.Handler objects, to sum up
+    # time spent per handler
+    def timeHandlers(self, handlers):
+        for handler in handlers:
+            if handler.importer is None or getattr(handler.importer, 'totals', None) is not None:
+                continue
+            handler.importer = _timedImporter(handler.importer, self.handlers.setdefault(handler.name, [0, 0.0]))
+
+    def report(self):
+        phases = []
+        for name in self.order:
+            entry = dict(self.phases[name], name=name)
+            phases.append(entry)
+        rates = {}
+        for counter, phase in (('rows', 'import'), ('transactions', 'import'), ('transactions', 'write')):
+            if counter in self.counters and phase in self.phases and self.phases[phase]['wall'] > 0:
+                rates['%s_per_second_%s' % (counter, phase)] = self.counters[counter] / self.phases[phase]['wall']
+        caches = {}
+        for name, (lookups, misses) in self.caches.iteritems():
+            total, missed = lookups(), misses()
+            caches[name] = {'lookups': total, 'misses': missed,
+                            'hit_rate': float(total - missed) / total if total else None}
+        return {'version': REPORT_VERSION,
+                'script': os.path.basename(sys.argv[0]),
+                'wall': time.time() - self.start,
+                'cpu': _cpuTime(),
+                'maxrss': _peakRSS(),
+                'phases': phases,
+                'counters': self.counters,
+                'rates': rates,
+                'caches': caches,
+                'handlers': dict((name, {'calls': calls, 'seconds': seconds})
+                                 for name, (calls, seconds) in self.handlers.iteritems())}
+
+    def printReport(self):
+        report = self.report()
+        for entry in report['phases']:
+            print "  %-12s %8.3fs wall %8.3fs cpu %8d kB peak rss" % (entry['name'], entry['wall'], entry['cpu'], entry['maxrss'])
+        for name, value in sorted(report['rates'].iteritems()):
+            print "  %s: %.1f" % (name.replace('_', ' '), value)
+        for name, cache in sorted(report['caches'].iteritems()):
+            if cache['lookups']:
+                print "  %s cache: %d lookups, %.1f%% hits" % (name, cache['lookups'], 100 * cache['hit_rate'])
+        for name, handler in sorted(report['handlers'].iteritems()):
+            print "  handler %s: %d calls, %.3fs" % (name, handler['calls'], handler['seconds'])
+
+# the active recorder, None while instrumentation is off
+current = None
+
+@contextmanager
+def _noPhase():
+    yield
+
+def phase(name):
+    if current is None:
+        return _noPhase()
+    return current.phase(name)
+
+def count(name, value=1):
+    if current is not None:
+        current.count(name, value)
+
+def watchCache(name, lookups, misses):
+    if current is not None:
+        current.watchCache(name, lookups, misses)
+
+def timeHandlers(handlers):
+    if current is not None:
+        current.timeHandlers(handlers)
+
+# add --report and --profile options to argparse parser
+def addArguments(parser):
+    parser.add_argument("--report", default=None, metavar="JSON", help="Write per-phase timings, memory use and counters "
+                                                                       "as JSON to this file")
+    parser.add_argument("--profile", default=None, metavar="PSTATS", help="Write a cProfile dump of the run to this file, "
+                                                                          "for pstats or snakeviz")
+
+# turn instrumentation on as per parsed args - with -v, phase timings
+# get printed at exit. Reports and profiles are written at exit, too,
+# so early bail-outs still leave numbers behind
+def setup(args):
+    global current
+    verbosity = getattr(args, 'verbosity', 0)
+    if not (args.report or args.profile or verbosity > 0):
+        return
+    current = Recorder(trace_memory=bool(args.report))
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+        if args.report:
+            with open(args.report, 'w') as out:
+                json.dump(current.report(), out, indent=2, sort_keys=True)
+        if verbosity > 0:
+            print "Timings:"
+            current.printReport()
+    atexit.register(finish)
@@ -0,0 +1,493 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import os, binascii, calendar, time, datetime
+from gncreader import NAMESPACES, qname, iterBook
+from gncwriter import escapeText, escapeAttribute, prefixedName, elementToXml
+
+# Compact, PyXB-free model of a GnuCash book, for the hot paths:
+# GUIDs are 16-byte strings, amounts integer numerator/denominator
+# pairs, timestamps seconds since epoch plus timezone offset in
+# minutes. Everything we don't need to look into (commodities,
+# prices, slots, scheduled transactions, business objects) is kept
+# as verbatim xml.
+
+_ACT_NAME = qname('act', 'name')
+_ACT_ID = qname('act', 'id')
+_ACT_TYPE = qname('act', 'type')
+_ACT_PARENT = qname('act', 'parent')
+_TRN_ID = qname('trn', 'id')
+_TRN_CURRENCY = qname('trn', 'currency')
+_TRN_NUM = qname('trn', 'num')
+_TRN_DATE_POSTED = qname('trn', 'date-posted')
+_TRN_DATE_ENTERED = qname('trn', 'date-entered')
+_TRN_DESCRIPTION = qname('trn', 'description')
+_TRN_SLOTS = qname('trn', 'slots')
+_TRN_SPLITS = qname('trn', 'splits')
+_SPLIT_ID = qname('split', 'id')
+_SPLIT_MEMO = qname('split', 'memo')
+_SPLIT_ACTION = qname('split', 'action')
+_SPLIT_STATE = qname('split', 'reconciled-state')
+_SPLIT_RECONCILE_DATE = qname('split', 'reconcile-date')
+_SPLIT_VALUE = qname('split', 'value')
+_SPLIT_QUANTITY = qname('split', 'quantity')
+_SPLIT_ACCOUNT = qname('split', 'account')
+_CMDTY_SPACE = qname('cmdty', 'space')
+_CMDTY_ID = qname('cmdty', 'id')
+_TS_DATE = qname('ts', 'date')
+_TS_NS = qname('ts', 'ns')
+_CD_TYPE = qname('cd', 'type')
+
+# share identical commodities and account references between all
+# transactions / splits
+_interned = {}
+def _intern(value):
+    return _interned.setdefault(value, value)
+
+def guidFromHex(value):
+    return binascii.unhexlify(value.strip())
+
+def hexFromGuid(value):
+    return binascii.hexlify(value)
+
+# '2010-01-01 00:00:00 +0100' -> (seconds since epoch, offset minutes)
+def parseTimestamp(value):
+    value = value.strip()
+    seconds = calendar.timegm((int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                               int(value[11:13]), int(value[14:16]), int(value[17:19])))
+    offset = int(value[21:23])*60 + int(value[23:25])
+    if value[20] == '-':
+        offset = -offset
+    return seconds - offset*60, offset
+
+def formatTimestamp(seconds, offset):
+    t = time.gmtime(seconds + offset*60)
+    return '%04d-%02d-%02d %02d:%02d:%02d %s%02d%02d' % (
+        t[0], t[1], t[2], t[3], t[4], t[5], '-' if offset < 0 else '+', abs(offset)//60, abs(offset)%60)
+
+# timespec element -> (seconds, offset, ns), ns being the optional
+# ts:ns nanoseconds older GnuCash versions wrote (None if absent)
+def _timespec(elem):
+    value = ns = None
+    for child in elem:
+        if child.tag == _TS_DATE:
+            value = child.text
+        elif child.tag == _TS_NS:
+            ns = int(child.text)
+        else:
+            raise ValueError('Unsupported timespec content in ledger: ' + child.tag)
+    if value is None:
+        raise ValueError('Timespec without ts:date in ledger')
+    seconds, offset = parseTimestamp(value)
+    return seconds, offset, ns
+
+# ts:ns line of a timespec, if it had one
+def _nsXml(ns, indent):
+    return '' if ns is None else '%s<ts:ns>%d</ts:ns>\n' % (indent, ns)
+
+# '101212/100' -> (101212, 100)
+def parseNumeric(value):
+    num, denom = value.strip().split('/')
+    return int(num), int(denom)
+
+def formatNumeric(num, denom):
+    return '%d/%d' % (num, denom)
+
+class Account(object):
+    '''GnuCash account - only the parts needed for lookups are parsed,
+       the element itself is kept verbatim'''
+    __slots__ = ('guid', 'name', 'type', 'parent', 'xml')
+
+    def __init__(self, guid, name, type, parent, xml):
+        self.guid = guid
+        self.name = name
+        self.type = type
+        self.parent = parent
+        self.xml = xml
+
+    @classmethod
+    def fromElement(cls, elem):
+        parent = elem.findtext(_ACT_PARENT)
+        return cls(guidFromHex(elem.findtext(_ACT_ID)), elem.findtext(_ACT_NAME),
+                   _intern(elem.findtext(_ACT_TYPE)),
+                   _intern(guidFromHex(parent)) if parent is not None else None,
+                   elementToXml(elem))
+
+    def hexGuid(self):
+        return hexFromGuid(self.guid)
+
+    # fields as plain tuple, for snapshots - fromState reverses that
+    def toState(self):
+        return (self.guid, self.name, self.type, self.parent, self.xml)
+
+    @classmethod
+    def fromState(cls, state):
+        self = cls.__new__(cls)
+        self.guid, self.name, type, parent, self.xml = state
+        self.type = _intern(type)
+        self.parent = _intern(parent) if parent is not None else None
+        return self
+
+    def toXml(self):
+        return self.xml + '\n'
+
+class Split(object):
+    '''Single split of a GnuCash transaction. tail holds verbatim
+       split:lot and split:slots, if any'''
+    __slots__ = ('guid', 'memo', 'action', 'state', 'reconciled', 'reconciled_tz', 'reconciled_ns',
+                 'value_num', 'value_denom', 'quantity_num', 'quantity_denom',
+                 'account', 'tail')
+
+    def __init__(self, guid, account, value_num, value_denom, quantity_num=None, quantity_denom=None,
+                 memo=None, action=None, state='n', reconciled=None, reconciled_tz=0, tail=None,
+                 reconciled_ns=None):
+        self.guid = guid
+        self.memo = memo
+        self.action = action
+        self.state = state
+        self.reconciled = reconciled
+        self.reconciled_tz = reconciled_tz
+        self.reconciled_ns = reconciled_ns
+        self.value_num = value_num
+        self.value_denom = value_denom
+        self.quantity_num = value_num if quantity_num is None else quantity_num
+        self.quantity_denom = value_denom if quantity_denom is None else quantity_denom
+        self.account = account
+        self.tail = tail
+
+    @classmethod
+    def fromElement(cls, elem):
+        self = cls.__new__(cls)
+        self.memo = self.action = self.reconciled = self.reconciled_ns = self.tail = None
+        self.reconciled_tz = 0
+        tail = []
+        for child in elem:
+            tag = child.tag
+            if tag == _SPLIT_ID:
+                self.guid = guidFromHex(child.text)
+            elif tag == _SPLIT_MEMO:
+                self.memo = child.text or ''
+            elif tag == _SPLIT_ACTION:
+                self.action = child.text or ''
+            elif tag == _SPLIT_STATE:
+                self.state = _intern(child.text.strip())
+            elif tag == _SPLIT_RECONCILE_DATE:
+                self.reconciled, self.reconciled_tz, self.reconciled_ns = _timespec(child)
+            elif tag == _SPLIT_VALUE:
+                self.value_num, self.value_denom = parseNumeric(child.text)
+            elif tag == _SPLIT_QUANTITY:
+                self.quantity_num, self.quantity_denom = parseNumeric(child.text)
+            elif tag == _SPLIT_ACCOUNT:
+                self.account = _intern(guidFromHex(child.text))
+            else:
+                tail.append('      ' + elementToXml(child) + '\n')
+        if tail:
+            self.tail = ''.join(tail)
+        return self
+
+    def toState(self):
+        return (self.guid, self.memo, self.action, self.state, self.reconciled, self.reconciled_tz, self.reconciled_ns,
+                self.value_num, self.value_denom, self.quantity_num, self.quantity_denom, self.account, self.tail)
+
+    @classmethod
+    def fromState(cls, state):
+        self = cls.__new__(cls)
+        (self.guid, self.memo, self.action, reconciled_state, self.reconciled, self.reconciled_tz, self.reconciled_ns,
+         self.value_num, self.value_denom, self.quantity_num, self.quantity_denom, account, self.tail) = state
+        self.state = _intern(reconciled_state)
+        self.account = _intern(account)
+        return self
+
+    def toXml(self):
+        parts = ['    <trn:split>\n',
+                 '      <split:id type="guid">%s</split:id>\n' % hexFromGuid(self.guid)]
+        if self.memo is not None:
+            parts.append('      <split:memo>%s</split:memo>\n' % escapeText(self.memo))
+        if self.action is not None:
+            parts.append('      <split:action>%s</split:action>\n' % escapeText(self.action))
+        parts.append('      <split:reconciled-state>%s</split:reconciled-state>\n' % self.state)
+        if self.reconciled is not None:
+            parts.append('      <split:reconcile-date>\n'
+                         '        <ts:date>%s</ts:date>\n%s'
+                         '      </split:reconcile-date>\n' % (formatTimestamp(self.reconciled, self.reconciled_tz),
+                                                             _nsXml(self.reconciled_ns, '        ')))
+        parts.append('      <split:value>%s</split:value>\n' % formatNumeric(self.value_num, self.value_denom))
+        parts.append('      <split:quantity>%s</split:quantity>\n' % formatNumeric(self.quantity_num, self.quantity_denom))
+        parts.append('      <split:account type="guid">%s</split:account>\n' % hexFromGuid(self.account))
+        if self.tail is not None:
+            parts.append(self.tail)
+        parts.append('    </trn:split>\n')
+        return ''.join(parts)
+
+class Transaction(object):
+    '''GnuCash transaction. currency is a (space, id) tuple, slots
+       verbatim xml if any, the *_ns timestamp nanoseconds None unless
+       the ledger had them'''
+    __slots__ = ('guid', 'currency', 'num', 'posted', 'posted_tz', 'posted_ns', 'entered', 'entered_tz', 'entered_ns',
+                 'description', 'slots', 'splits')
+
+    def __init__(self, guid, currency, posted, posted_tz, entered, entered_tz,
+                 description=None, splits=None, num=None, slots=None, posted_ns=None, entered_ns=None):
+        self.guid = guid
+        self.currency = _intern(currency)
+        self.num = num
+        self.posted = posted
+        self.posted_tz = posted_tz
+        self.posted_ns = posted_ns
+        self.entered = entered
+        self.entered_tz = entered_tz
+        self.entered_ns = entered_ns
+        self.description = description
+        self.slots = slots
+        self.splits = splits if splits is not None else []
+
+    @classmethod
+    def fromElement(cls, elem):
+        self = cls.__new__(cls)
+        self.num = self.description = self.slots = None
+        self.splits = []
+        for child in elem:
+            tag = child.tag
+            if tag == _TRN_ID:
+                self.guid = guidFromHex(child.text)
+            elif tag == _TRN_CURRENCY:
+                self.currency = _intern((child.findtext(_CMDTY_SPACE).strip(), child.findtext(_CMDTY_ID).strip()))
+            elif tag == _TRN_NUM:
+                self.num = child.text or ''
+            elif tag == _TRN_DATE_POSTED:
+                self.posted, self.posted_tz, self.posted_ns = _timespec(child)
+            elif tag == _TRN_DATE_ENTERED:
+                self.entered, self.entered_tz, self.entered_ns = _timespec(child)
+            elif tag == _TRN_DESCRIPTION:
+                self.description = child.text or ''
+            elif tag == _TRN_SLOTS:
+                self.slots = elementToXml(child)
+            elif tag == _TRN_SPLITS:
+                self.splits = [Split.fromElement(split) for split in child]
+            else:
+                raise ValueError('Unsupported transaction content in ledger: ' + tag)
+        return self
+
+    def toState(self):
+        return (self.guid, self.currency, self.num, self.posted, self.posted_tz, self.posted_ns,
+                self.entered, self.entered_tz, self.entered_ns, self.description, self.slots, [split.toState() for split in self.splits])
+
+    @classmethod
+    def fromState(cls, state):
+        self = cls.__new__(cls)
+        (self.guid, currency, self.num, self.posted, self.posted_tz, self.posted_ns,
+         self.entered, self.entered_tz, self.entered_ns, self.description, self.slots, splits) = state
+        self.currency = _intern(currency)
+        splitFromState = Split.fromState
+        self.splits = [splitFromState(split) for split in splits]
+        return self
+
+    # posting date as naive datetime, in the transaction's timezone
+    def datePosted(self):
+        return datetime.datetime.utcfromtimestamp(self.posted + self.posted_tz*60)
+
+    def toXml(self):
+        parts = ['<gnc:transaction version="2.0.0">\n',
+                 '  <trn:id type="guid">%s</trn:id>\n' % hexFromGuid(self.guid),
+                 '  <trn:currency>\n'
+                 '    <cmdty:space>%s</cmdty:space>\n'
+                 '    <cmdty:id>%s</cmdty:id>\n'
+                 '  </trn:currency>\n' % (escapeText(self.currency[0]), escapeText(self.currency[1]))]
+        if self.num is not None:
+            parts.append('  <trn:num>%s</trn:num>\n' % escapeText(self.num))
+        parts.append('  <trn:date-posted>\n'
+                     '    <ts:date>%s</ts:date>\n%s'
+                     '  </trn:date-posted>\n'
+                     '  <trn:date-entered>\n'
+                     '    <ts:date>%s</ts:date>\n%s'
+                     '  </trn:date-entered>\n' % (formatTimestamp(self.posted, self.posted_tz), _nsXml(self.posted_ns, '    '),
+                                                  formatTimestamp(self.entered, self.entered_tz), _nsXml(self.entered_ns, '    ')))
+        if self.description is not None:
+            parts.append('  <trn:description>%s</trn:description>\n' % escapeText(self.description))
+        if self.slots is not None:
+            parts.append('  ' + self.slots + '\n')
+        parts.append('  <trn:splits>\n')
+        for split in self.splits:
+            parts.append(split.toXml())
+        parts.append('  </trn:splits>\n'
+                     '</gnc:transaction>\n')
+        return ''.join(parts)
+
+# number of GUIDs drawn from one os.urandom call
+GUID_BATCH = 1024
+
+class TransactionBuilder(object):
+    '''Creates transactions from importer data. The shape is fixed and
+       known good, so there is nothing to validate; GUIDs come in bulk
+       from one urandom buffer, and date entered, currencies, posting
+       dates and accounts are converted once and then shared'''
+    def __init__(self, date_entered, batch=GUID_BATCH):
+        self.entered, self.entered_tz = parseTimestamp(date_entered)
+        self.batch = batch
+        self.guids = []
+        self.currencies = {}
+        self.dates = {}
+        self.accounts = {}
+        # transactions and splits created, for cache statistics
+        self.created = 0
+        self.splits = 0
+
+    # fresh random 16-byte GUID
+    def guid(self):
+        if not self.guids:
+            buf = os.urandom(16*self.batch)
+            self.guids = [buf[i:i+16] for i in xrange(0, len(buf), 16)]
+        return self.guids.pop()
+
+    # create new transaction. date_posted is a GnuCash timestamp
+    # string, splits a sequence of (account guid in hex, memo, GnuCash
+    # numeric string) tuples. num is the transaction's reference
+    # number, if any
+    def create(self, currency, date_posted, description, splits, num=None):
+        commodity = self.currencies.get(currency)
+        if commodity is None:
+            commodity = self.currencies[currency] = _intern(('ISO4217', currency))
+        posted = self.dates.get(date_posted)
+        if posted is None:
+            posted = self.dates[date_posted] = parseTimestamp(date_posted)
+
+        txn = Transaction(self.guid(), commodity, posted[0], posted[1], self.entered, self.entered_tz,
+                          description, num=num)
+        self.created += 1
+        self.splits += len(splits)
+        for account, memo, value in splits:
+            account_guid = self.accounts.get(account)
+            if account_guid is None:
+                account_guid = self.accounts[account] = _intern(guidFromHex(account))
+            num, denom = parseNumeric(value)
+            txn.splits.append(Split(self.guid(), account_guid, num, denom, memo=memo))
+        return txn
+
+class Book(object):
+    '''Complete GnuCash book, in compact form. account and transaction
+       are named like their PyXB counterparts. pricedb holds the
+       attributes of gnc:pricedb as xml, None if the book has none.
+       kinds lists what got loaded, None meaning everything'''
+    __slots__ = ('guid', 'slots', 'counts', 'commodities', 'pricedb', 'prices',
+                 'account', 'transaction', 'tail', 'kinds')
+
+    def __init__(self):
+        self.guid = None
+        self.slots = None
+        self.counts = []
+        self.commodities = []
+        self.pricedb = None
+        self.prices = []
+        self.account = []
+        self.transaction = []
+        self.tail = []
+        self.kinds = None
+
+    # load book from file via the streaming reader. Pass kinds to only
+    # load part of the book (e.g. just accounts) - such books can't be
+    # written back, of course.
+    @classmethod
+    def load(cls, source, kinds=None):
+        self = cls()
+        self.kinds = tuple(kinds) if kinds is not None else None
+        for kind, elem in iterBook(source, kinds):
+            if kind == 'transaction':
+                self.transaction.append(Transaction.fromElement(elem))
+            elif kind == 'account':
+                self.account.append(Account.fromElement(elem))
+            elif kind == 'id':
+                self.guid = guidFromHex(elem.text)
+            elif kind == 'slots':
+                self.slots = elementToXml(elem)
+            elif kind == 'count-data':
+                self.counts.append([elem.get(_CD_TYPE), int(elem.text)])
+            elif kind == 'commodity':
+                self.commodities.append(elementToXml(elem))
+            elif kind == 'price':
+                self.prices.append(elementToXml(elem))
+            elif kind == 'pricedb':
+                self.pricedb = ''.join([' %s="%s"' % (prefixedName(key), escapeAttribute(value))
+                                        for key, value in elem.items()])
+            else:
+                self.tail.append(elementToXml(elem))
+        return self
+
+    # whether all of kinds (None meaning everything) got loaded
+    def holds(self, kinds):
+        return self.kinds is None or (kinds is not None and set(kinds) <= set(self.kinds))
+
+    # book as nested tuples and lists of plain values, which marshal
+    # handles much faster than pickle does objects
+    def toState(self):
+        return (self.guid, self.slots, self.counts, self.commodities, self.pricedb, self.prices,
+                [account.toState() for account in self.account],
+                [txn.toState() for txn in self.transaction],
+                self.tail, self.kinds)
+
+    @classmethod
+    def fromState(cls, state):
+        self = cls.__new__(cls)
+        (self.guid, self.slots, self.counts, self.commodities, self.pricedb, self.prices,
+         accounts, transactions, self.tail, self.kinds) = state
+        self.account = [Account.fromState(account) for account in accounts]
+        txnFromState = Transaction.fromState
+        self.transaction = [txnFromState(txn) for txn in transactions]
+        return self
+
+    def append(self, txn):
+        self.transaction.append(txn)
+
+    # add transactions gncwriter.spliceTransactions appended to the
+    # written ledger, bumping the counter the same way
+    def extendSpliced(self, transactions):
+        self.transaction.extend(transactions)
+        for count in self.counts:
+            if count[0] == 'transaction':
+                count[1] += len(transactions)
+                break
+        else:
+            self.counts.append(['transaction', len(transactions)])
+
+    # write complete ledger to file object out
+    def write(self, out):
+        out.write('<?xml version="1.0" encoding="utf-8" ?>\n<gnc-v2')
+        for prefix in sorted(NAMESPACES):
+            out.write('\n     xmlns:%s="%s"' % (prefix, NAMESPACES[prefix]))
+        out.write('>\n<gnc:count-data cd:type="book">1</gnc:count-data>\n'
+                  '<gnc:book version="2.0.0">\n'
+                  '<book:id type="guid">%s</book:id>\n' % hexFromGuid(self.guid))
+        if self.slots is not None:
+            out.write(self.slots + '\n')
+
+        # keep counters in sync with what we actually write, in here
+        # too (so snapshots match the file)
+        for kind, items in (('account', self.account), ('transaction', self.transaction)):
+            for count in self.counts:
+                if count[0] == kind:
+                    count[1] = len(items)
+                    break
+            else:
+                if items:
+                    self.counts.append([kind, len(items)])
+        for kind, value in self.counts:
+            out.write('<gnc:count-data cd:type="%s">%d</gnc:count-data>\n' % (kind, value))
+
+        for commodity in self.commodities:
+            out.write(commodity + '\n')
+        if self.pricedb is not None:
+            out.write('<gnc:pricedb%s>\n' % self.pricedb)
+            for price in self.prices:
+                out.write('  ' + price + '\n')
+            out.write('</gnc:pricedb>\n')
+        for account in self.account:
+            out.write(account.toXml())
+        for txn in self.transaction:
+            out.write(txn.toXml())
+        for elem in self.tail:
+            out.write(elem + '\n')
+        out.write('</gnc:book>\n</gnc-v2>\n')
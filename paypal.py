@@ -7,68 +7,42 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import sys, gzip, uuid, re
-import pyxb, csv, argparse, logging
+import sys, uuid
+import argparse, logging
 
-import gnucash, gnc, trn, cmdty, ts, split   # Bindings generated by PyXB
-from datetime import date, datetime
-from fractions import Fraction
+from bindings import pyxb, gnc, trn, cmdty, ts, split   # Bindings generated by PyXB, loaded on first use
+import currency
 from currency import CurrencyConverter
-
-# meh, for export, have to manually declare namespace prefixes
-import cd
-import _nsgroup as ns
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_act, 'act')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_addr, 'addr')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_bgt, 'bgt')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_billterm, 'billterm')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_book, 'book')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_bt_days, 'bt-days')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_bt_prox, 'bt-prox')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(cd.Namespace, 'cd')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_cmdty, 'cmdty')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_cust, 'cust')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_employee, 'employee')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_gnc, 'gnc')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_invoice, 'invoice')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_job, 'job')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_lot, 'lot')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_order, 'order')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_owner, 'owner')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_price, 'price')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_recurrence, 'recurrence')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_slot, 'slot')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_split, 'split')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_sx, 'sx')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_taxtable, 'taxtable')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_trn, 'trn')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ts.Namespace, 'ts')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_tte, 'tte')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_vendor, 'vendor')
+import csvinput, instrument, gncimport, gncdate, plugins, rules, ledger
+from amount import parseAmount, parseFloat, negateAmount, gnucashFromAmount, GERMAN
+from dupeindex import DuplicateIndex
+from refchain import RefChains
+
+# CSV dialect PayPal exports by default
+DELIMITER = '\t'
+ENCODING = 'iso-8859-1'
+# plugin attribute naming the rows a snippet handles
+SCRIPT_KEY = 'type_and_state'
+# rows to look ahead for lines referencing each other
+WINDOW = 1000
+# fields for rule templates, i.e. InputLine attributes
+RULE_FIELDS = ('name', 'transaction_date', 'transaction_type', 'transaction_state', 'transaction_currency',
+               'transaction_gross', 'transaction_fee', 'transaction_net', 'transaction_id', 'reference_txn')
 
 def getGNCDateStr(date_obj):
-    return date_obj.strftime('%Y-%m-%d %H:%M:%S +0100')
+    return gncdate.formatDate(date_obj)
+
+# CSV columns, in the order InputLine takes them
+PROFILE = csvinput.Profile(('Date', 'Time', 'Time Zone', 'Name', 'Type', 'Status', 'Currency',
+                            'Gross', 'Fee', 'Net', 'Transaction ID', 'Reference Txn ID'),
+                           texts=('Name',), optional=('Time Zone',))
 
 class InputLine:
-    def __init__(self, line):
-        # remove crap, encode into unicode
-        try:
-            name = re.sub(r"[\x01-\x1F\x7F]", "", line[" Name"])
-        except:
-            if args.verbosity > 0: print "Failing line cleanse: %s" % str(line)
-
-        self.name = name.decode(args.encoding, errors='ignore')
-        self.transaction_date = datetime.strptime(
-            line["Date"] + " " + line[" Time"],
-            '%d.%m.%Y %H:%M:%S')
-        self.transaction_type = line[" Type"]
-        self.transaction_state = line[" Status"]
-        self.transaction_currency = line[" Currency"]
-        self.transaction_gross = line[" Gross"]
-        self.transaction_fee = line[" Fee"]
-        self.transaction_net = line[" Net"]
-        self.transaction_id  = line[" Transaction ID"]
-        self.reference_txn = line[" Reference Txn ID"]
+    def __init__(self, row):
+        (date, time, time_zone, self.name, self.transaction_type, self.transaction_state,
+         self.transaction_currency, self.transaction_gross, self.transaction_fee, self.transaction_net,
+         self.transaction_id, self.reference_txn) = row
+        self.transaction_date = gncdate.parseDate(date + " " + time, 'dmyHMS', gncdate.tzFromPayPal(time_zone))[0]
     def __str__(self):
         return "%s %s %s %s %s %s %s %s %s" % (getGNCDateStr(self.transaction_date),
                                                self.transaction_type,
@@ -80,61 +54,40 @@ class InputLine:
                                                self.transaction_id,
                                                self.reference_txn)
 
-# convert number to integer string (possibly via conversion to rational number)
-def gnucashFromAmount(value):
-    rational_value = Fraction(value).limit_denominator(1000)
-    return str(rational_value.numerator)+"/"+str(rational_value.denominator)
+# read and parse all rows of a PayPal CSV export, in jobs processes.
+# Only plain data is returned, so this can run in a worker process
+def readCSV(csvfile, delimiter=DELIMITER, quotechar='"', encoding=ENCODING, verbosity=0, jobs=1):
+    return csvinput.parseRows(InputLine, csvinput.readRows(csvfile, PROFILE, delimiter, quotechar, encoding), jobs)
 
 class PayPalConverter:
-    def __init__(self, book, args):
+    def __init__(self, book, account_index, args, **kwargs):
         # enter current time as "date entered"
-        self.now = datetime.now().strftime('%Y-%m-%d %H:%M:%S +0100')
-        self.acc_lookup = {}
+        self.now = gncdate.now()
         self.document = book
-        self.accounts = book.account
+        self.new_transactions = []
+        self.account_index = account_index
+        self.builder = ledger.TransactionBuilder(self.now) if gncimport.splicing(args) else None
+        self.verbosity = args.verbosity
         self.default_currency = args.currency
-        self.currency_converter = CurrencyConverter(verbosity=args.verbosity)
+        self.currency_converter = kwargs.pop('currency_converter', None) or CurrencyConverter(verbosity=args.verbosity, base_url=args.rates_url)
 
     # convert float from paypal number string
     def amountFromPayPal(self, value):
         # assume German locale here for the while
-        minusIdx = value.find("-")
-        preMult  = 1
-        if minusIdx != -1:
-            value = value[minusIdx+1:]
-            preMult = -1
-        # kill all thousands separators, split off fractional part
-        value_parts = value.replace(".","").split(',')
-        if len(value_parts) == 1:
-            return preMult * float(value_parts[0])
-        if len(value_parts) == 2:
-            return preMult * (float(value_parts[0]) + float(value_parts[1])/(10**len(value_parts[1])))
-        else:
-            raise IndexError
+        return parseFloat(value, GERMAN)
 
     # wrap the converter here, to be able to convert value to float if
     # necessary
     def currencyConvert(self, value, currency, txn_date):
         if isinstance(value, str):
             value = self.amountFromPayPal(value)
-        return self.currency_converter.convert(value, currency, args.currency, txn_date)
+        return self.currency_converter.convert(value, currency, self.default_currency, txn_date)
 
-    # lookup account with given name (and optionally type) in dict (or
-    # search in xml tree)
+    # lookup account with given name (and optionally type) in account
+    # index
     def lookupAccountUUID(self, account_name, **kwargs):
         acc_type = kwargs.pop('type', '')
-        lookup_key = acc_type+account_name
-
-        if self.acc_lookup.has_key(lookup_key):
-            return self.acc_lookup[lookup_key]
-        else:
-            for elem in self.accounts:
-                # get account with matching name and type (partial match is ok)
-                if elem.name.find(account_name) != -1 and elem.type.find(acc_type) != -1:
-                    self.acc_lookup[lookup_key] = elem.id.value()
-                    return elem.id.value()
-        print "Did not find account with name %s in current book, bailing out!" % account_name
-        exit(1)
+        return gncimport.lookupAccountUUID(self.account_index, account_name, acc_type)
 
     # add a gnucash split transaction with the given data
     def addTransaction(self, **kwargs):
@@ -155,62 +108,57 @@ class PayPalConverter:
                 transaction_currency = self.default_currency
             else:
                 print "Wrong currency for main transaction encountered, bailing out!"
-                if args.verbosity > 0: print "Context: "+str(currLine)
+                if self.verbosity > 0: print "Context: "+transaction_description
                 exit(1)
 
-        try:
-            transaction=gnc.transaction(
-                trn.id( uuid.uuid4().hex, type="guid" ),
-                trn.currency( cmdty.space("ISO4217"), cmdty.id(transaction_currency) ),
-                trn.date_posted( ts.date(getGNCDateStr(transaction_date)) ),
-                trn.date_entered( ts.date(self.now) ),
-                trn.description(transaction_description),
-                trn.splits(),
-                version="2.0.0")
-
-            for curr_split in txn[0]:
+        # debit splits first, then credit splits
+        splits = []
+        for side, sign in ((txn[0], 1), (txn[1], -1)):
+            for curr_split in side:
                 split_account = curr_split[0]
                 split_memo    = curr_split[1]
                 split_value   = curr_split[2]
 
+                # PayPal strings are booked exactly, floats (converted
+                # values) rounded to cents
                 if isinstance(split_value, str):
-                    split_value = self.amountFromPayPal(split_value)
+                    split_value = parseAmount(split_value, GERMAN)
                 if len(curr_split) > 3:
                     split_uuid = self.lookupAccountUUID(split_account, type=curr_split[3])
                 else:
                     split_uuid = self.lookupAccountUUID(split_account)
 
-                transaction.splits.append(
-                    trn.split(
-                        split.id( uuid.uuid4().hex, type="guid" ),
-                        split.memo( split_memo ),
-                        split.reconciled_state( "n" ),
-                        split.value( gnucashFromAmount(split_value) ),
-                        split.quantity( gnucashFromAmount(split_value) ),
-                        split.account( split_uuid, type="guid" )) )
+                splits.append((split_uuid, split_memo, gnucashFromAmount(split_value if sign > 0 else negateAmount(split_value))))
 
-            for curr_split in txn[1]:
-                split_account = curr_split[0]
-                split_memo    = curr_split[1]
-                split_value   = curr_split[2]
+        # gets spliced into a copy of the ledger - no need for bindings
+        if self.builder is not None:
+            self.new_transactions.append(
+                self.builder.create(transaction_currency, getGNCDateStr(transaction_date),
+                                    transaction_description, splits))
+            return
 
-                if isinstance(split_value, str):
-                    split_value = self.amountFromPayPal(split_value)
-                if len(curr_split) > 3:
-                    split_uuid = self.lookupAccountUUID(split_account, type=curr_split[3])
-                else:
-                    split_uuid = self.lookupAccountUUID(split_account)
+        try:
+            transaction=gnc.transaction(
+                trn.id( uuid.uuid4().hex, type="guid" ),
+                trn.currency( cmdty.space("ISO4217"), cmdty.id(transaction_currency) ),
+                trn.date_posted( ts.date(getGNCDateStr(transaction_date)) ),
+                trn.date_entered( ts.date(self.now) ),
+                trn.description(transaction_description),
+                trn.splits(),
+                version="2.0.0")
 
+            for split_uuid, split_memo, split_value in splits:
                 transaction.splits.append(
                     trn.split(
                         split.id( uuid.uuid4().hex, type="guid" ),
                         split.memo( split_memo ),
                         split.reconciled_state( "n" ),
-                        split.value( gnucashFromAmount(-split_value) ),
-                        split.quantity( gnucashFromAmount(-split_value) ),
+                        split.value( split_value ),
+                        split.quantity( split_value ),
                         split.account( split_uuid, type="guid" )) )
 
-            self.document.append(transaction)
+            gncimport.appendTransaction(self.document, transaction)
+            self.new_transactions.append(transaction)
 
         except pyxb.UnrecognizedContentError as e:
             print '*** ERROR validating input:'
@@ -232,167 +180,210 @@ def default_importer(converter, **kwargs):
         txn=([('PayPal',    "Unknown transaction", currLine.transaction_net)],
              [('Imbalance', "Unknown PayPal",      currLine.transaction_net)]) )
 
-
-# main script
-parser = argparse.ArgumentParser(description="Import PayPal transactions from CSV",
-                                 epilog="Extend this script by plugin snippets, that are simple python scripts with the following "
-                                 "at the toplevel namespace (example):"
-                                 "type_and_state = 'DonationsCompleted'"
-                                 "def importer(PayPalConverter, **kwargs): converter.addTransaction(...)")
-parser.add_argument("-v", "--verbosity", action="count", default=0, help="Increase verbosity by one (defaults to off)")
-parser.add_argument("-p", "--pretty", action="store_true", default=False, help="Export xml pretty-printed (defaults to off)")
-parser.add_argument("-d", "--delimiter", default='\t', help="Delimiter used in the CSV file  (defaults to tab)")
-parser.add_argument("-q", "--quotechar", default='"', help="Quote character used in the CSV file (defaults to '\"')")
-parser.add_argument("-e", "--encoding", default='iso-8859-1', help="Character encoding used in the CSV file (defaults to iso-8859-1)")
-parser.add_argument("-c", "--currency", default="EUR", help="Currency all transactions are expected to be in (defaults to EUR)")
-parser.add_argument("-s", "--script", action="append", help="Plugin snippets for sorting into different accounts")
-parser.add_argument("ledger_gnucash", help="GnuCash ledger you want to import into")
-parser.add_argument("paypal_csv", help="PayPal CSV export you want to import")
-parser.add_argument("output_gnucash", help="Output GnuCash ledger file")
-args = parser.parse_args()
-
-gncfile = args.ledger_gnucash
-csvfile = args.paypal_csv
-outfile = args.output_gnucash
-
-logger = logging.StreamHandler()
-logger.setLevel(logging.INFO if args.verbosity > 0 else logging.ERROR)
-logging.getLogger('').addHandler(logger)
-
-if args.verbosity > 0: print "Opening gnc file"
-
-# read GnuCash data
-try:
-    f = gzip.open(gncfile)
-    gncxml = f.read()
-except:
-    f = open(gncfile)
-    gncxml = f.read()
-
-# read paypal csv data
-paypal_csv = csv.DictReader(open(csvfile), delimiter=args.delimiter, quotechar=args.quotechar)
-
-if args.verbosity > 0: print "Parsing gnc file"
-
-try:
-    doc = gnucash.CreateFromDocument(
-        gncxml,
-        location_base=gncfile)
-except pyxb.UnrecognizedContentError as e:
-    print '*** ERROR validating input:'
-    print 'Unrecognized element "%s" at %s (details: %s)' % (e.content.expanded_name, e.content.location, e.details())
-except pyxb.UnrecognizedDOMRootNodeError as e:
-    print '*** ERROR matching content:'
-    print e.details()
-
-conversion_scripts = {}
-# import conversion scripts
-if args.script:
-    for index,script in enumerate(args.script):
-        ns_name = "script"+str(index)
-        exec "import "+script+" as "+ns_name
-        conversion_scripts[eval(ns_name+".type_and_state")] = ns_name
-
-if args.verbosity > 0: print "Importing CSV transactions"
-
-converter = PayPalConverter(doc.book, args)
-fwd_refs = {}
-back_refs = {}
-prev_line = None
-
-for index,line in enumerate(paypal_csv):
-    currLine = InputLine(line)
-
-    # stick unmatched transactions into Imbalance account, in case we
-    # don't find a handler below
-    importer = default_importer
-
-    # store txn id for potential back references
-    back_refs[currLine.transaction_id] = currLine
-
-    # find matching conversion script, if any
-    if conversion_scripts.has_key(currLine.transaction_type+currLine.transaction_state):
-        if eval(conversion_scripts[currLine.transaction_type+currLine.transaction_state]+".merge_nextline"):
-            # store current line for _exactly_  one additional transaction
-            if prev_line != None:
-                print "Merge_nextline requested, but already pending line in line %d of %s, bailing out" % (index, args.paypal_csv)
-                if args.verbosity > 0: print "Context: "+str(line)
+# importer for declarative rules (see rules.py): book net value from
+# account1 to account2, memos and description from templates. A
+# preceding currency conversion into ledger currency is booked as
+# such, like test_paypal_donation does
+def ruleImporter(account1_name, account2_name, memo1, memo2, description):
+    def importer(converter, **kwargs):
+        currLine = kwargs.pop('line')
+        previous = kwargs.pop('previous', [])
+        if isinstance(previous, InputLine):
+            previous = [previous]
+        fields = vars(currLine)
+
+        transaction_currency = currLine.transaction_currency
+        transaction_net = currLine.transaction_net
+        transaction_date = currLine.transaction_date
+        for line in previous:
+            if (line.transaction_type == 'Currency Conversion' and
+                line.transaction_state == 'Completed' and
+                line.transaction_currency == converter.default_currency):
+                transaction_currency = line.transaction_currency
+                transaction_net = line.transaction_net
+                transaction_date = line.transaction_date
+
+        converter.addTransaction(
+            date=transaction_date,
+            currency=transaction_currency,
+            description=description % fields,
+            txn=([(account1_name, memo1 % fields, transaction_net)],
+                 [(account2_name, memo2 % fields, transaction_net)]) )
+    return importer
+
+# book parsed CSV lines into book, return list of new transactions
+def importLines(lines, book, account_index, conversion_scripts, args, **kwargs):
+    dupes = kwargs.pop('dupes', None)
+    csvfile = kwargs.pop('csvfile', '')
+    converter = PayPalConverter(book, account_index, args, currency_converter=kwargs.pop('converter', None))
+
+    # look up rates for all foreign currency lines in one go, plugins
+    # then find them cached
+    converter.currency_converter.prefetch((currLine.transaction_currency, args.currency, currLine.transaction_date.date())
+                                          for currLine in lines if currLine.transaction_currency != args.currency)
+
+    # book chain of lines, once complete
+    def bookChain(chain):
+        references = chain.lines()
+        if chain.main is None:
+            # stick unmatched TxnReferences into imbalance account
+            for currLine in references:
+                default_importer(converter, line=currLine, linenum=-1, args=args)
+            return
+
+        currLine, importer, prev_line, index = chain.main
+
+        # already booked? drop it then, along with anything merged into it
+        if dupes is not None and currLine.transaction_id in dupes:
+            if args.verbosity > 0: print "Skipping already imported transaction in line %d of %s" % (index, csvfile)
+            return
+
+        # run it
+        if prev_line != None:
+            if references:
+                print "Previous line merge done, but conflicting reference Txn found in line %d of %s, bailing out" % (index, csvfile)
+                if args.verbosity > 0: print "Context: "+str(currLine)
                 exit(1)
-            prev_line = currLine
-            continue # no further processing
-        elif eval(conversion_scripts[currLine.transaction_type+currLine.transaction_state]+".store_fwdref"):
-            # any backreferences to merge with?
-            if back_refs.has_key(currLine.reference_txn):
-                if back_refs[currLine.reference_txn].reference_txn == "":
-                    print "Back reference without own forward reference, cannot merge after-the-fact line %d of %s, bailing out" % (index, args.paypal_csv)
-                    if args.verbosity > 0: print "Context: "+str(line)
+
+            # extra arg for previous line
+            importer(converter, line=currLine, linenum=index, previous=prev_line, args=args)
+        elif references:
+            # extra arg for list of reference txn
+            importer(converter, line=currLine, linenum=index, previous=references, args=args)
+        else:
+            # no extra args, just this one txn
+            importer(converter, line=currLine, linenum=index, args=args)
+
+    # lines referencing each other, joined up within the look-ahead
+    # window, in any order
+    chains = RefChains(args.window or None)
+    prev_line = None
+    prev_index = -1
+
+    for index,currLine in enumerate(lines):
+        # book what can't grow any further
+        for chain in chains.advance(index - 1):
+            bookChain(chain)
+
+        # stick unmatched transactions into Imbalance account, in case we
+        # don't find a handler below
+        importer = default_importer
+
+        # find matching conversion script, if any
+        handler = conversion_scripts.get(currLine.transaction_type+currLine.transaction_state)
+        if handler is not None:
+            if handler.merge_nextline:
+                # store current line for _exactly_  one additional transaction
+                if prev_line != None:
+                    print "Merge_nextline requested, but already pending line in line %d of %s, bailing out" % (index, csvfile)
+                    if args.verbosity > 0: print "Context: "+str(currLine)
                     exit(1)
-                # yup. gobble up prev line, if any
+                prev_line = currLine
+                prev_index = index
+                continue # no further processing
+            elif handler.store_fwdref:
+                # gobble up prev line, if any, into the same chain
                 if prev_line != None:
-                    fwd_refs[back_refs[currLine.reference_txn].reference_txn].append(prev_line)
+                    chains.addReference(prev_index, prev_line.transaction_id, currLine.reference_txn, prev_line)
                     prev_line = None
-                # and now append ourself to that one
-                fwd_refs[back_refs[currLine.reference_txn].reference_txn].append(currLine)
+
+                chains.addReference(index, currLine.transaction_id, currLine.reference_txn, currLine)
+                continue # no further processing
+            elif handler.ignore:
+                print "Ignoring transaction in line %d of %s" % (index, csvfile)
+                if args.verbosity > 0: print "Context: "+str(currLine)
                 continue # no further processing
+            else:
+                # now actually import transaction at hand
+                importer = handler.importer
 
-            if not fwd_refs.has_key(currLine.reference_txn):
-                fwd_refs[currLine.reference_txn] = []
-
-            # are we ourselves referenced? merge then. this joins up
-            # chains of Txn references into one list, keeping only the
-            # reference to the root transaction in the hash.
-            if fwd_refs.has_key(currLine.transaction_id):
-                fwd_refs[currLine.reference_txn].extend(fwd_refs[currLine.transaction_id])
-                del fwd_refs[currLine.transaction_id]
-
-            # gobble up prev line, if any
-            if prev_line != None:
-                fwd_refs[currLine.reference_txn].append(prev_line)
-                prev_line = None
-
-            fwd_refs[currLine.reference_txn].append(currLine)
-            continue # no further processing
-        elif eval(conversion_scripts[currLine.transaction_type+currLine.transaction_state]+".ignore"):
-            print "Ignoring transaction in line %d of %s" % (index, args.paypal_csv)
-            if args.verbosity > 0: print "Context: "+str(currLine)
-            continue # no further processing
-        else:
-            # now actually import transaction at hand
-            importer = eval(conversion_scripts[currLine.transaction_type+currLine.transaction_state]+".importer")
+        # booked once no more references can turn up
+        chains.addMain(index, currLine.transaction_id, (currLine, importer, prev_line, index))
+        prev_line = None
+
+    for chain in chains.flush():
+        bookChain(chain)
 
-    # run it
+    # stick unused merge line into imbalance account
     if prev_line != None:
-        if fwd_refs.has_key(currLine.transaction_id):
-            print "Previous line merge done, but conflicting reference Txn found in line %d of %s, bailing out" % (index, args.paypal_csv)
-            if args.verbosity > 0: print "Context: "+str(line)
-            exit(1)
+        default_importer(converter, line=prev_line, linenum=-1, args=args)
 
-        # extra arg for previous line
-        importer(converter, line=currLine, linenum=index, previous=prev_line, args=args)
-        prev_line = None
-    elif fwd_refs.has_key(currLine.transaction_id):
-        # extra arg for list of reference txn
-        importer(converter, line=currLine, linenum=index, previous=fwd_refs[currLine.transaction_id], args=args)
-        del fwd_refs[currLine.transaction_id]
-    else:
-        # no extra args, just this one txn
-        importer(converter, line=currLine, linenum=index, args=args)
-
-# stick unmatched TxnReferences into imbalance account
-for entry in fwd_refs.itervalues():
-    for currLine in entry:
-        default_importer(converter, line=currLine, linenum=-1, args=args)
-
-# stick unused merge line into imbalance account
-if prev_line != None:
-    default_importer(doc.book, createTransaction, 'PayPal', 'Imbalance', line=prev_line, linenum=-1, args=args)
-
-if args.verbosity > 0: print "Writing resulting ledger"
-
-# write out amended ledger
-out = open(outfile, "wb")
-if args.pretty:
-    dom = doc.toDOM()
-    out.write( dom.toprettyxml(indent=" ", encoding='utf-8') )
-else:
-    out.write( doc.toxml(encoding='utf-8') )
+    return converter.new_transactions
+
+# main script
+def main():
+    parser = argparse.ArgumentParser(description="Import PayPal transactions from CSV",
+                                     epilog="Extend this script by plugin snippets, that are simple python scripts with the following "
+                                     "at the toplevel namespace (example):"
+                                     "type_and_state = 'DonationsCompleted'"
+                                     "def importer(PayPalConverter, **kwargs): converter.addTransaction(...)")
+    parser.add_argument("-v", "--verbosity", action="count", default=0, help="Increase verbosity by one (defaults to off)")
+    parser.add_argument("-p", "--pretty", action="store_true", default=False, help="Export xml pretty-printed (defaults to off)")
+    parser.add_argument("-z", "--compress", type=int, choices=range(1, 10), metavar="LEVEL", help="Write output gzip-compressed at LEVEL, "
+                                                                                                  "1 (fastest) to 9 (smallest) (defaults to off)")
+    parser.add_argument("-a", "--append", action="store_true", default=False, help="Copy input ledger verbatim and only append new "
+                                                                                  "transactions, instead of re-serializing it (defaults to off)")
+    parser.add_argument("-l", "--lean", action="store_true", default=False, help="Don't load the full ledger, only its accounts, and "
+                                                                                "append new transactions in compact form (implies -a)")
+    parser.add_argument("-S", "--snapshot", action="store_true", default=False, help="With -l, load the ledger from its snapshot "
+                                                                                     "if current, and save one of the output (defaults to off)")
+    parser.add_argument("-u", "--unique", action="store_true", default=False, help="Skip CSV rows whose transaction id is already "
+                                                                                  "booked in the ledger (defaults to off)")
+    parser.add_argument("-V", "--defer-validation", action="store_true", default=False, help="Skip PyXB validation while loading "
+                                                                                            "and writing, check the resulting ledger in one "
+                                                                                            "pass instead (defaults to off)")
+    parser.add_argument("-d", "--delimiter", default=DELIMITER, help="Delimiter used in the CSV file  (defaults to tab)")
+    parser.add_argument("-q", "--quotechar", default='"', help="Quote character used in the CSV file (defaults to '\"')")
+    parser.add_argument("-e", "--encoding", default=ENCODING, help="Character encoding used in the CSV file (defaults to iso-8859-1)")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes parsing the CSV file (defaults to 1)")
+    parser.add_argument("-w", "--window", type=int, default=WINDOW, help="Rows to look ahead for lines referencing each other, "
+                                                                         "0 for the whole file (defaults to %d)" % WINDOW)
+    parser.add_argument("-c", "--currency", default="EUR", help="Currency all transactions are expected to be in (defaults to EUR)")
+    parser.add_argument("-s", "--script", action="append", help="Plugin snippets for sorting into different accounts")
+    parser.add_argument("-r", "--rules", action="append", help="Rule files for sorting into different accounts, tried "
+                                                                "after plugin snippets")
+    parser.add_argument("ledger_gnucash", help="GnuCash ledger you want to import into")
+    parser.add_argument("paypal_csv", help="PayPal CSV export you want to import")
+    parser.add_argument("output_gnucash", help="Output GnuCash ledger file")
+    currency.addArguments(parser)
+    instrument.addArguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    gncfile = args.ledger_gnucash
+    csvfile = args.paypal_csv
+    outfile = args.output_gnucash
+
+    logger = logging.StreamHandler()
+    logger.setLevel(logging.INFO if args.verbosity > 0 else logging.ERROR)
+    logging.getLogger('').addHandler(logger)
+
+    # read paypal csv data
+    with instrument.phase('csv'):
+        lines = readCSV(csvfile, args.delimiter, args.quotechar, args.encoding, args.verbosity, args.jobs)
+    instrument.count('rows', len(lines))
+
+    if args.defer_validation:
+        gncimport.deferValidation()
+    doc, book = gncimport.loadBook(gncfile, args.lean, args.verbosity, args.snapshot)
+    account_index = gncimport.indexAccounts(book, args.lean)
+
+    # import conversion scripts
+    with instrument.phase('plugins'):
+        conversion_scripts = plugins.loadPlugins(args.script, SCRIPT_KEY, account_index)
+        conversion_scripts = rules.loadRules(args.rules, SCRIPT_KEY, RULE_FIELDS, ruleImporter, account_index, conversion_scripts)
+    instrument.timeHandlers(conversion_scripts.values())
+
+    if args.verbosity > 0: print "Importing CSV transactions"
+
+    # provider ids already in the ledger, to skip re-imported rows
+    with instrument.phase('dupes'):
+        dupes = DuplicateIndex(gncfile, verbosity=args.verbosity) if args.unique else None
+    with instrument.phase('import'):
+        new_transactions = importLines(lines, book, account_index, conversion_scripts, args,
+                                       dupes=dupes, csvfile=csvfile)
+
+    gncimport.writeBook(gncfile, outfile, doc, new_transactions, args, book)
+
+if __name__ == '__main__':
+    main()
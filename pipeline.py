@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import sys, logging, argparse
+import multiprocessing
+
+import currency
+from currency import CurrencyConverter
+import gncimport, plugins, rules, instrument
+from dupeindex import DuplicateIndex
+import paypal, concardis, bitpay
+
+# importer modules, by name used on the command line
+PROVIDERS = {
+    'paypal':    paypal,
+    'concardis': concardis,
+    'bitpay':    bitpay }
+
+# main script
+def main():
+    parser = argparse.ArgumentParser(description="Import CSV exports of several payment providers into one GnuCash ledger",
+                                     epilog="The ledger is loaded and written only once. CSV files are parsed concurrently, "
+                                     "then booked in the order given on the command line. Plugin snippets are handed to "
+                                     "the importer whose key attribute they define (type_and_state for PayPal, "
+                                     "desc_method_brand for Concardis, type_curr for BitPay).")
+    parser.add_argument("-v", "--verbosity", action="count", default=0, help="Increase verbosity by one (defaults to off)")
+    parser.add_argument("-p", "--pretty", action="store_true", default=False, help="Export xml pretty-printed (defaults to off)")
+    parser.add_argument("-z", "--compress", type=int, choices=range(1, 10), metavar="LEVEL", help="Write output gzip-compressed at LEVEL, "
+                                                                                                  "1 (fastest) to 9 (smallest) (defaults to off)")
+    parser.add_argument("-a", "--append", action="store_true", default=False, help="Copy input ledger verbatim and only append new "
+                                                                                  "transactions, instead of re-serializing it (defaults to off)")
+    parser.add_argument("-l", "--lean", action="store_true", default=False, help="Don't load the full ledger, only its accounts, and "
+                                                                                "append new transactions in compact form (implies -a)")
+    parser.add_argument("-S", "--snapshot", action="store_true", default=False, help="With -l, load the ledger from its snapshot "
+                                                                                     "if current, and save one of the output (defaults to off)")
+    parser.add_argument("-u", "--unique", action="store_true", default=False, help="Skip CSV rows whose transaction id is already "
+                                                                                  "booked in the ledger (defaults to off)")
+    parser.add_argument("-V", "--defer-validation", action="store_true", default=False, help="Skip PyXB validation while loading "
+                                                                                            "and writing, check the resulting ledger in one "
+                                                                                            "pass instead (defaults to off)")
+    parser.add_argument("-w", "--window", type=int, default=paypal.WINDOW, help="Rows to look ahead for PayPal lines referencing "
+                                                                                "each other, 0 for the whole file (defaults to %d)" % paypal.WINDOW)
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="Number of processes parsing CSV files (defaults to number of CPUs)")
+    parser.add_argument("-c", "--currency", default="EUR", help="Currency all transactions are converted into (defaults to EUR)")
+    parser.add_argument("-s", "--script", action="append", help="Plugin snippets for sorting into different accounts")
+    parser.add_argument("-r", "--rules", action="append", help="Rule files for sorting into different accounts, tried "
+                                                                "after plugin snippets")
+    parser.add_argument("-i", "--input", action="append", required=True, metavar="PROVIDER:CSV",
+                        help="CSV export to import, e.g. paypal:export.csv. Providers: %s" % ", ".join(sorted(PROVIDERS)))
+    parser.add_argument("ledger_gnucash", help="GnuCash ledger you want to import into")
+    parser.add_argument("output_gnucash", help="Output GnuCash ledger file")
+    currency.addArguments(parser)
+    instrument.addArguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    gncfile = args.ledger_gnucash
+    outfile = args.output_gnucash
+
+    logger = logging.StreamHandler()
+    logger.setLevel(logging.INFO if args.verbosity > 0 else logging.ERROR)
+    logging.getLogger('').addHandler(logger)
+
+    sources = []
+    for source in args.input:
+        provider, sep, csvfile = source.partition(':')
+        if not sep or provider not in PROVIDERS:
+            print "Unknown input %s, expected one of %s followed by :<csv file>, bailing out!" % (source, ", ".join(sorted(PROVIDERS)))
+            exit(1)
+        sources.append((PROVIDERS[provider], csvfile))
+
+    # parse all csv files concurrently, while we load the ledger
+    jobs = min(args.jobs or multiprocessing.cpu_count(), len(sources))
+    if jobs > 1:
+        if args.verbosity > 0: print "Parsing %d CSV files in %d processes" % (len(sources), jobs)
+        pool = multiprocessing.Pool(jobs)
+        pending = [pool.apply_async(module.readCSV, (csvfile,), {'verbosity': args.verbosity})
+                   for module, csvfile in sources]
+        pool.close()
+    else:
+        pool = None
+
+    if args.defer_validation:
+        gncimport.deferValidation()
+    doc, book = gncimport.loadBook(gncfile, args.lean, args.verbosity, args.snapshot)
+    account_index = gncimport.indexAccounts(book, args.lean)
+
+    # provider ids already in the ledger, to skip re-imported rows
+    with instrument.phase('dupes'):
+        dupes = DuplicateIndex(gncfile, verbosity=args.verbosity) if args.unique else None
+    converter = CurrencyConverter(verbosity=args.verbosity, base_url=args.rates_url)
+
+    # and book them one after the other, in command line order
+    new_transactions = []
+    for index, (module, csvfile) in enumerate(sources):
+        with instrument.phase('csv'):
+            if pool is not None:
+                lines = pending[index].get()
+            else:
+                lines = module.readCSV(csvfile, verbosity=args.verbosity)
+        instrument.count('rows', len(lines))
+
+        if args.verbosity > 0: print "Importing CSV transactions from %s" % csvfile
+
+        with instrument.phase('plugins'):
+            conversion_scripts = plugins.loadPlugins(args.script, module.SCRIPT_KEY, account_index)
+            conversion_scripts = rules.loadRules(args.rules, module.SCRIPT_KEY, module.RULE_FIELDS, module.ruleImporter,
+                                                 account_index, conversion_scripts)
+        instrument.timeHandlers(conversion_scripts.values())
+        with instrument.phase('import'):
+            new_transactions.extend(module.importLines(lines, book, account_index, conversion_scripts, args,
+                                                       dupes=dupes, csvfile=csvfile, converter=converter))
+    if pool is not None:
+        pool.join()
+
+    gncimport.writeBook(gncfile, outfile, doc, new_transactions, args, book)
+
+if __name__ == '__main__':
+    main()
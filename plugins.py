@@ -0,0 +1,77 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import gncimport
+
+# plugin keys whose plugins name their two accounts (Concardis,
+# BitPay). The others (PayPal) steer line merging via flags instead
+ACCOUNT_KEYS = ('desc_method_brand', 'type_curr')
+
+# PayPal plugin flags, in the order they are evaluated - the first one
+# set wins, the later ones need not exist then
+FLAGS = ('merge_nextline', 'store_fwdref', 'ignore')
+
+class PluginError(Exception):
+    pass
+
+class Handler:
+    '''What to do with a CSV line: the importer function, with its
+       accounts already resolved to guids (for Concardis and BitPay),
+       or its line merging flags (for PayPal)
+    '''
+    def __init__(self, name, importer, account_index=None, account1_name=None, account2_name=None, **kwargs):
+        self.name = name
+        self.importer = importer
+        self.merge_nextline = kwargs.pop('merge_nextline', False)
+        self.store_fwdref = kwargs.pop('store_fwdref', False)
+        self.ignore = kwargs.pop('ignore', False)
+        self.account1_uuid = None
+        self.account2_uuid = None
+        if account1_name is not None:
+            self.account1_uuid = gncimport.lookupAccountUUID(account_index, account1_name)
+            self.account2_uuid = gncimport.lookupAccountUUID(account_index, account2_name)
+
+    # validate plugin snippet module, and make a handler from it
+    @classmethod
+    def fromModule(cls, module, key, account_index):
+        name = module.__name__
+        if key in ACCOUNT_KEYS:
+            for attribute in ('account1_name', 'account2_name', 'importer'):
+                if not hasattr(module, attribute):
+                    raise PluginError('Plugin %s lacks %s' % (name, attribute))
+            if not callable(module.importer):
+                raise PluginError('Plugin %s: importer is not a function' % name)
+            return cls(name, module.importer, account_index, module.account1_name, module.account2_name)
+
+        flags = {}
+        for flag in FLAGS:
+            if not hasattr(module, flag):
+                raise PluginError('Plugin %s lacks %s' % (name, flag))
+            flags[flag] = bool(getattr(module, flag))
+            if flags[flag]:
+                return cls(name, getattr(module, 'importer', None), **flags)
+        if not callable(getattr(module, 'importer', None)):
+            raise PluginError('Plugin %s lacks an importer function' % name)
+        return cls(name, module.importer, **flags)
+
+# import plugin snippets once, validate them, and return dispatch
+# table of key (e.g. 'type_and_state' value) -> Handler. Snippets
+# lacking key belong to other importers and are skipped, so one list of
+# scripts can serve several importers. Bails out on broken plugins.
+def loadPlugins(scripts, key, account_index):
+    handlers = {}
+    for script in scripts or []:
+        module = __import__(script)
+        if not hasattr(module, key):
+            continue
+        try:
+            handlers[getattr(module, key)] = Handler.fromModule(module, key, account_index)
+        except PluginError as e:
+            print "%s, bailing out!" % e
+            exit(1)
+    return handlers
@@ -7,53 +7,71 @@
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 #
 
-import sys, gzip, uuid, re
-import pyxb, argparse
-
-import gnucash, gnc, trn, cmdty, ts, split   # Bindings generated by PyXB
-from datetime import date, datetime
-
-# meh, for export, have to manually declare namespace prefixes
-import cd
-import _nsgroup as ns
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_act, 'act')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_addr, 'addr')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_bgt, 'bgt')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_billterm, 'billterm')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_book, 'book')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_bt_days, 'bt-days')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_bt_prox, 'bt-prox')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(cd.Namespace, 'cd')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_cmdty, 'cmdty')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_cust, 'cust')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_employee, 'employee')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_gnc, 'gnc')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_invoice, 'invoice')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_job, 'job')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_lot, 'lot')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_order, 'order')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_owner, 'owner')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_price, 'price')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_recurrence, 'recurrence')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_slot, 'slot')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_split, 'split')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_sx, 'sx')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_taxtable, 'taxtable')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_trn, 'trn')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ts.Namespace, 'ts')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_tte, 'tte')
-pyxb.utils.domutils.BindingDOMSupport.DeclareNamespace(ns._Namespace_vendor, 'vendor')
-
-# lookup account with given name in dict (or search in xml tree)
-def lookupAccountUUID(xml_tree, account_name):
-    for elem in xml_tree:
-        # get account with matching name (partial match is ok)
-        if elem.name.find(account_name) != -1:
-            accounts[account_name] = elem.id.value()
-            return elem.id.value()
-
-    print "Did not find account with name %s in current book, bailing out!" % account_name
-    exit(1)
+import sys, gzip, uuid, re, time, calendar
+import argparse
+from bisect import bisect_right
+
+from bindings import pyxb, gnucash   # Bindings generated by PyXB, loaded on first use
+import ledger, gncwriter, instrument, snapshot
+from accountindex import AccountIndex
+from gncimport import lookupAccountUUID
+from datetime import datetime
+
+# sorted, non-overlapping date ranges, for bisecting. Bounds are
+# wall-clock seconds since epoch, both inclusive
+class DateRanges:
+    def __init__(self, ranges):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(ranges):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __contains__(self, stamp):
+        index = bisect_right(self.starts, stamp) - 1
+        return index >= 0 and stamp <= self.ends[index]
+
+# all -m patterns, tried in one go. match(text) returns (pattern
+# index, joined groups) of the first pattern matching text, or None
+class Matcher:
+    def __init__(self, patterns):
+        self.patterns = [re.compile(pattern) for pattern in patterns]
+        self.combined = None
+        # backreferences would need renumbering, and inline flags like
+        # (?i) apply to the whole regex - try those one by one
+        if not [pattern for pattern in patterns if re.search(r'\\[1-9]|\(\?P=|\(\?[iLmsux]', pattern)]:
+            # outer group index -> (pattern index, its own group indexes)
+            self.groups = {}
+            alternatives = []
+            offset = 1
+            for index, compiled in enumerate(self.patterns):
+                self.groups[offset] = (index, range(offset + 1, offset + 1 + compiled.groups))
+                alternatives.append('(%s)' % patterns[index])
+                offset += 1 + compiled.groups
+            try:
+                self.combined = re.compile('|'.join(alternatives))
+            except re.error:
+                pass
+
+    def match(self, text):
+        if self.combined is not None:
+            m = self.combined.match(text)
+            if m is None:
+                return None
+            index, groups = self.groups[m.lastindex]
+            return index, "".join([m.group(group) or "" for group in groups])
+        for index, compiled in enumerate(self.patterns):
+            m = compiled.match(text)
+            if m is not None:
+                return index, "".join([group or "" for group in m.groups()])
+        return None
+
+# wall-clock seconds since epoch for YYYY-MM-DD
+def stampFromDate(value):
+    return calendar.timegm(datetime.strptime(value, '%Y-%m-%d').timetuple())
 
 # main script
 parser = argparse.ArgumentParser(description="Prune certain transactions",
@@ -67,132 +85,172 @@ parser = argparse.ArgumentParser(description="Prune certain transactions",
                                         "will remove *all* matching withdrawal transactions.")
 parser.add_argument("-v", "--verbosity", action="count", default=0, help="Increase verbosity by one (defaults to off)")
 parser.add_argument("-p", "--pretty", action="store_true", default=False, help="Export xml pretty-printed (defaults to off)")
+parser.add_argument("-z", "--compress", type=int, choices=range(1, 10), metavar="LEVEL", help="Write output gzip-compressed at LEVEL, "
+                                                                                              "1 (fastest) to 9 (smallest) (defaults to off)")
+parser.add_argument("-l", "--lean", action="store_true", default=False, help="Use compact ledger model instead of PyXB "
+                                                                            "bindings (defaults to off)")
+parser.add_argument("-S", "--snapshot", action="store_true", default=False, help="With -l, load the ledger from its snapshot "
+                                                                                 "if current, and save one of the output (defaults to off)")
 parser.add_argument("-a", "--account", action="append", help="Account names to match")
 parser.add_argument("-d", "--date", action="append", help="Date range, e.g. 2012-01-01..2012-02-01, or 2012-01-01..")
 parser.add_argument("-m", "--match", action="append", help="Template string for description to match. Can be regexp. Use "
                                                            "grouping to request dupe removals.")
+parser.add_argument("-n", "--dry-run", action="store_true", default=False, help="Only report the number of matching "
+                                                                                "transactions and timings, write nothing (defaults to off)")
 parser.add_argument("ledger_gnucash", help="GnuCash ledger you want to import into")
 parser.add_argument("output_gnucash", help="Output GnuCash ledger file")
+instrument.addArguments(parser)
 args = parser.parse_args()
+instrument.setup(args)
 
 gncfile = args.ledger_gnucash
 outfile = args.output_gnucash
 
-if args.verbosity > 0: print "Opening gnc file"
+start_time = time.time()
 
-# read GnuCash data
-try:
-    f = gzip.open(gncfile)
-    gncxml = f.read()
-except:
-    f = open(gncfile)
-    gncxml = f.read()
+if args.lean:
+    if args.verbosity > 0: print "Loading gnc file"
 
-if args.verbosity > 0: print "Parsing gnc file"
+    book = None
+    if args.snapshot:
+        with instrument.phase('snapshot'):
+            book = snapshot.load(gncfile, verbosity=args.verbosity)
+    if book is None:
+        with instrument.phase('parse'):
+            book = ledger.Book.load(gncfile)
 
-try:
-    doc = gnucash.CreateFromDocument(
-        gncxml,
-        location_base=gncfile)
-except pyxb.UnrecognizedContentError as e:
-    print '*** ERROR validating input:'
-    print 'Unrecognized element "%s" at %s (details: %s)' % (e.content.expanded_name, e.content.location, e.details())
-except pyxb.UnrecognizedDOMRootNodeError as e:
-    print '*** ERROR matching content:'
-    print e.details()
+    # accessors for the compact model
+    txnSplits = lambda txn: txn.splits
+    splitAccount = lambda split: split.account
+    txnStamp = lambda txn: txn.posted + txn.posted_tz*60
+else:
+    if args.verbosity > 0: print "Opening gnc file"
+
+    # read GnuCash data
+    with instrument.phase('read'):
+        try:
+            f = gzip.open(gncfile)
+            gncxml = f.read()
+        except:
+            f = open(gncfile)
+            gncxml = f.read()
+
+    if args.verbosity > 0: print "Parsing gnc file"
 
-if args.verbosity > 0: print "Attempting delete over %d transactions..." % len(doc.book.transaction)
+    try:
+        with instrument.phase('parse'):
+            doc = gnucash.CreateFromDocument(
+                gncxml,
+                location_base=gncfile)
+    except pyxb.UnrecognizedContentError as e:
+        print '*** ERROR validating input:'
+        print 'Unrecognized element "%s" at %s (details: %s)' % (e.content.expanded_name, e.content.location, e.details())
+    except pyxb.UnrecognizedDOMRootNodeError as e:
+        print '*** ERROR matching content:'
+        print e.details()
+    book = doc.book
+
+    # accessors for the PyXB bindings
+    txnSplits = lambda txn: txn.splits.split
+    splitAccount = lambda split: split.account.value()
+    def txnStamp(txn):
+        seconds, offset = ledger.parseTimestamp(str(txn.date_posted.date))
+        return seconds + offset*60
+
+load_time = time.time()
+if args.verbosity > 0: print "Attempting delete over %d transactions..." % len(book.transaction)
 
 # fill uuids of accounts we want to match
-accounts = {}
+accounts = set()
 if args.account:
+    account_index = AccountIndex.fromLedger(book.account) if args.lean else AccountIndex.fromBindings(book.account)
     for acc in args.account:
-        account_uuid = lookupAccountUUID(doc.book.account, acc)
-        accounts[account_uuid] = True
+        account_uuid = lookupAccountUUID(account_index, acc)
+        accounts.add(ledger.guidFromHex(account_uuid) if args.lean else account_uuid)
 
-# fill date predicates of dates we want to match
-dates = []
+# fill date ranges we want to match
+dates = None
 if args.date:
+    ranges = []
     for dt in args.date:
         dt_range = str.split(dt, "..")
         if dt_range is None or len(dt_range) != 2:
             print "Invalid date predicate given: "+dt
             exit(1)
-        if dt_range[0] == '':
-            upper=datetime.strptime(dt_range[1], '%Y-%m-%d')
-            dates.append( lambda x, upper=upper: x <= upper )
-        elif dt_range[1] == '':
-            lower=datetime.strptime(dt_range[0], '%Y-%m-%d')
-            dates.append( lambda x, lower=lower: lower <= x)
-        else:
-            lower=datetime.strptime(dt_range[0], '%Y-%m-%d')
-            upper=datetime.strptime(dt_range[1], '%Y-%m-%d')
-            dates.append( lambda x, lower=lower, upper=upper: lower <= x <= upper )
-
-# fill compiled regexs we want memo / desc strings to match against
-regexps = []
-if args.match:
-    regexps = [ re.compile(x) for x in args.match ]
-
-# go through all Txn (backwards, to make inplace deletion not screw
-# up iterator)
-matches = {}
-for index in range(len(doc.book.transaction) - 1, -1, -1):
-    txn = doc.book.transaction[index]
-    match = False
-    if len(accounts):
-        for split in txn.splits.split:
-            if accounts.has_key( split.account.value() ):
-                match = True
-                break
-        if not match:
-            continue
+        try:
+            ranges.append((stampFromDate(dt_range[0]) if dt_range[0] else -sys.maxint,
+                           stampFromDate(dt_range[1]) if dt_range[1] else sys.maxint))
+        except ValueError:
+            print "Invalid date predicate given: "+dt
+            exit(1)
+    dates = DateRanges(ranges)
+
+# combined regex we want memo / desc strings to match against
+matcher = Matcher(args.match) if args.match else None
 
-    match = False
-    if len(dates):
-        for pred in dates:
-            if pred( datetime.strptime(
-                    str.split(str(txn.date_posted.date), ' +')[0], '%Y-%m-%d %H:%M:%S') ):
-                match = True
-                break
-        if not match:
+# go through all Txn, newest (i.e. last) first, so dupe removal keeps
+# those
+transactions = book.transaction
+instrument.count('transactions', len(transactions))
+with instrument.phase('query'):
+    keep = [True] * len(transactions)
+    matches = {}
+    for index in xrange(len(transactions) - 1, -1, -1):
+        txn = transactions[index]
+        if accounts and accounts.isdisjoint([splitAccount(split) for split in txnSplits(txn)]):
             continue
 
-    match = False
-    if len(regexps):
-        key = ""
-        for exp in regexps:
-            m0 = exp.match( txn.description if txn.description else "" )
-            if m0 is not None:
-                match = True
-                key = "".join(m0.groups())
-                break
-            for split in txn.splits.split:
-                m1 = exp.match( split.memo if split.memo else "" )
-                if m1 is not None:
-                    match = True
-                    key = "".join(m1.groups())
-                    break
-        if not match:
+        if dates is not None and txnStamp(txn) not in dates:
             continue
 
-        # dupe removal case? empty key otherwise means 'remove all
-        # matches'
-        if len(key) > 0:
-            if not key in matches:
-                # new encounter, stick into dict, do *not* remove
-                matches[key] = True
+        if matcher is not None:
+            # first pattern matching description or any split memo wins,
+            # description first
+            best = matcher.match(txn.description if txn.description else "")
+            for split in txnSplits(txn):
+                if best is not None and best[0] == 0:
+                    break
+                m = matcher.match(split.memo if split.memo else "")
+                if m is not None and (best is None or m[0] < best[0]):
+                    best = m
+            if best is None:
                 continue
+            key = best[1]
+
+            # dupe removal case? empty key otherwise means 'remove all
+            # matches'
+            if len(key) > 0:
+                if not key in matches:
+                    # new encounter, stick into dict, do *not* remove
+                    matches[key] = True
+                    continue
 
-    if args.verbosity > 0: print "Deleting txn %s" % txn.description
-    del doc.book.transaction[index]
+        if args.verbosity > 0: print "Deleting txn %s" % txn.description
+        keep[index] = False
+
+    # rebuild transaction list in one go
+    kept = [txn for txn, wanted in zip(transactions, keep) if wanted]
+deleted = len(transactions) - len(kept)
+query_time = time.time()
+
+if args.dry_run:
+    print "%d of %d transactions match (loading %.3fs, query %.3fs)" % (deleted, len(transactions),
+                                                                        load_time - start_time, query_time - load_time)
+    exit(0)
+
+transactions[:] = kept
 
 if args.verbosity > 0: print "Writing resulting ledger"
 
 # write out amended ledger
-out = open(outfile, "wb")
-if args.pretty:
-    dom = doc.toDOM()
-    out.write( dom.toprettyxml(indent=" ", encoding='utf-8') )
-else:
-    out.write( doc.toxml(encoding='utf-8') )
+with instrument.phase('write'):
+    out = gncwriter.openOutput(outfile, args.compress)
+    if args.lean:
+        book.write(out)
+    else:
+        gncwriter.writeDocument(out, doc, " " if args.pretty else None)
+    out.close()
+
+if args.snapshot and args.lean:
+    with instrument.phase('snapshot'):
+        snapshot.save(outfile, book, args.verbosity)
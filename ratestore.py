@@ -0,0 +1,185 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import os, bisect, array, datetime, urllib2
+try:
+    import xml.etree.cElementTree as ElemTree
+except ImportError:
+    import xml.etree.ElementTree as ElemTree
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# full history since 1999, and the last 90 days only
+ECB_HIST_URL = 'http://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist.xml'
+ECB_90D_URL = 'http://www.ecb.europa.eu/stats/eurofxref/eurofxref-hist-90d.xml'
+EUROFXREF_CUBE = '{http://www.ecb.int/vocabulary/2002-08-01/eurofxref}Cube'
+
+# don't use rates older than this many days before the requested date
+# (covers weekends and the longest ECB holiday breaks)
+MAX_GAP = 7
+
+# parse eurofxref xml from file object, yielding (date ordinal,
+# {currency: rate against EUR}) per day, in document order (which is
+# newest first for the ECB files)
+def parseEurofxref(source):
+    for event, elem in ElemTree.iterparse(source):
+        if elem.tag == EUROFXREF_CUBE and 'time' in elem.attrib:
+            day = datetime.datetime.strptime(elem.attrib['time'], '%Y-%m-%d').toordinal()
+            yield day, dict((entry.attrib['currency'], float(entry.attrib['rate'])) for entry in elem)
+            elem.clear()
+
+class RateStore:
+    '''Local store of ECB reference rates, in ~/.cache/pygnclib/rates.
+
+       Rates are kept per currency, as two flat binary files of
+       ascending date ordinals and rates, which are loaded on first
+       use of a currency. The store is initially filled from the full
+       ECB history, and only appended to afterwards - the network is
+       only touched if a date newer than the newest stored rate is
+       asked for, and then at most once a day.
+    '''
+    def __init__(self, **kwargs):
+        self.verbosity = kwargs.pop('verbosity', 0)
+        self.path = kwargs.pop('path', os.getenv('HOME', default='') + '/.cache/pygnclib/rates')
+        self.timeout = kwargs.pop('timeout', 30)
+        # currency -> array of date ordinals / rates, ascending by date
+        self.dates = {}
+        self.rates = {}
+        # currency -> same as numpy arrays, made on demand
+        self.vectors = {}
+        # newest date in the store, and day we last asked the ECB
+        self.newest = 0
+        self.checked = 0
+        self.tried = False
+        stamp = os.path.join(self.path, 'stamp')
+        if os.path.exists(stamp):
+            f = open(stamp)
+            self.newest, self.checked = [int(field) for field in f.read().split()]
+            f.close()
+
+    def writeStamp(self):
+        stamp = os.path.join(self.path, 'stamp')
+        f = open(stamp + '.tmp', 'w')
+        f.write('%d %d\n' % (self.newest, self.checked))
+        f.close()
+        os.rename(stamp + '.tmp', stamp)
+
+    # return (dates, rates) arrays for currency, loading them if needed
+    def series(self, currency):
+        if currency not in self.dates:
+            dates = array.array('i')
+            rates = array.array('d')
+            base = os.path.join(self.path, currency)
+            if os.path.exists(base + '.dates') and os.path.exists(base + '.rates'):
+                for values, filename in ((dates, base + '.dates'), (rates, base + '.rates')):
+                    f = open(filename, 'rb')
+                    values.fromfile(f, os.path.getsize(filename) / values.itemsize)
+                    f.close()
+                # only keep complete entries, should an append have been
+                # interrupted
+                count = min(len(dates), len(rates))
+                del dates[count:]
+                del rates[count:]
+            self.dates[currency] = dates
+            self.rates[currency] = rates
+        return self.dates[currency], self.rates[currency]
+
+    # add (date ordinal, {currency: rate}) entries newer than what we
+    # have, in any order
+    def append(self, entries):
+        entries = sorted(entry for entry in entries if entry[0] > self.newest)
+        if not entries:
+            return
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        added = {}
+        for day, day_rates in entries:
+            for currency, rate in day_rates.iteritems():
+                added.setdefault(currency, []).append((day, rate))
+        for currency, values in added.iteritems():
+            dates, rates = self.series(currency)
+            new_dates = array.array('i', [day for day, rate in values])
+            new_rates = array.array('d', [rate for day, rate in values])
+            base = os.path.join(self.path, currency)
+            # rates first - a dangling rate is dropped on load
+            for new_values, filename in ((new_rates, base + '.rates'), (new_dates, base + '.dates')):
+                f = open(filename, 'ab')
+                new_values.tofile(f)
+                f.close()
+            dates.extend(new_dates)
+            rates.extend(new_rates)
+            self.vectors.pop(currency, None)
+
+        self.newest = entries[-1][0]
+        self.writeStamp()
+
+    # fetch rates newer than the newest stored ones from the ECB. Only
+    # tried once a day (and once per run), failure leaves the store as
+    # it is
+    def update(self):
+        today = datetime.date.today().toordinal()
+        if self.checked == today or self.tried:
+            return
+        self.tried = True
+        # the 90 day file is enough if the store is recent
+        url = ECB_90D_URL if today - self.newest < 90 else ECB_HIST_URL
+        if self.verbosity > 0: print 'Downloading %s' % url
+        try:
+            self.append(parseEurofxref(urllib2.urlopen(url, timeout=self.timeout)))
+        except Exception as e:
+            if self.verbosity > 0: print 'Failed to update exchange rates: %s' % e
+            return
+        self.checked = today
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.writeStamp()
+
+    # rate of currency against EUR, valid on date - i.e. the latest one
+    # published on or before it
+    def rate(self, currency, date):
+        if currency == 'EUR':
+            return 1.0
+        day = date.toordinal()
+        if day > self.newest:
+            self.update()
+        dates, rates = self.series(currency)
+        pos = bisect.bisect_right(dates, day) - 1
+        if pos < 0 or day - dates[pos] > MAX_GAP:
+            raise KeyError('No %s exchange rate for %s' % (currency, date))
+        return rates[pos]
+
+    # rates of currency against EUR for a sequence of date ordinals, nan
+    # where there is none. Returns a numpy array if numpy is available,
+    # a list otherwise
+    def rateMany(self, currency, days):
+        if currency == 'EUR':
+            return numpy.ones(len(days)) if numpy is not None else [1.0] * len(days)
+        if len(days) and max(days) > self.newest:
+            self.update()
+        dates, rates = self.series(currency)
+        if numpy is None:
+            result = []
+            for day in days:
+                pos = bisect.bisect_right(dates, day) - 1
+                result.append(rates[pos] if pos >= 0 and day - dates[pos] <= MAX_GAP else float('nan'))
+            return result
+
+        if not len(dates):
+            return numpy.repeat(numpy.nan, len(days))
+        if currency not in self.vectors:
+            self.vectors[currency] = (numpy.array(dates, dtype=numpy.int32), numpy.array(rates, dtype=numpy.float64))
+        dates, rates = self.vectors[currency]
+        days = numpy.asarray(days, dtype=numpy.int32)
+        pos = numpy.searchsorted(dates, days, side='right') - 1
+        valid = pos >= 0
+        pos[~valid] = 0
+        valid &= days - dates[pos] <= MAX_GAP
+        return numpy.where(valid, rates[pos], numpy.nan)
@@ -0,0 +1,156 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import heapq
+from collections import deque
+
+# Joins CSV lines referencing each other into chains, e.g. PayPal's
+# currency conversion lines (whose reference id names the donation
+# they belong to) with that donation. Every reference line links its
+# own id to the id it references, so each chain is a tree of ids with
+# exactly one id not referencing anything - the main line's, if that
+# one shows up. Chains are kept in a union-find structure, so rows may
+# come in any order.
+#
+# With a window, a chain counts as complete once that many rows went
+# by without touching it, and is handed out and forgotten - memory
+# then stays bounded, however long the file. Chains are handed out in
+# order of their main line's row (or of completion, for chains that
+# never got one), so output order does not depend on timing.
+
+class Chain(object):
+    '''Main line (if any) with the reference lines joined to it'''
+    __slots__ = ('main', 'references', 'ids', 'last', 'done')
+
+    def __init__(self):
+        self.main = None
+        # (row, line) tuples
+        self.references = []
+        self.ids = []
+        self.last = -1
+        self.done = False
+
+    # reference lines, in file order
+    def lines(self):
+        return [line for row, line in sorted(self.references, key=lambda reference: reference[0])]
+
+class RefChains:
+    '''Resolves reference chains, see above. window is the number of
+       rows a chain may go untouched before it counts as complete -
+       None waits for the end of the file'''
+    def __init__(self, window=None):
+        self.window = window
+        # union-find parent links, and chain of each root id
+        self.parent = {}
+        self.chains = {}
+        # (last row, chain) - stale entries are skipped when popped
+        self.expiry = []
+        # chains in hand-out order
+        self.queue = deque()
+
+    def find(self, node):
+        root = node
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[node] != root:
+            self.parent[node], node = root, self.parent[node]
+        return root
+
+    # chain for id, creating an empty one if unknown
+    def chain(self, node):
+        if node not in self.parent:
+            self.parent[node] = node
+            chain = self.chains[node] = Chain()
+            chain.ids.append(node)
+            return node, chain
+        root = self.find(node)
+        return root, self.chains[root]
+
+    def union(self, node1, node2):
+        root1, chain1 = self.chain(node1)
+        root2, chain2 = self.chain(node2)
+        if root1 == root2:
+            return chain1
+        # hang the smaller tree below the larger - unless the smaller
+        # one has the main line, which keeps its chain (and thus its
+        # place in the queue) then
+        if chain2.main is not None or (chain1.main is None and len(chain1.ids) < len(chain2.ids)):
+            root1, chain1, root2, chain2 = root2, chain2, root1, chain1
+        self.parent[root2] = root1
+        del self.chains[root2]
+        chain1.ids.extend(chain2.ids)
+        chain1.references.extend(chain2.references)
+        chain1.last = max(chain1.last, chain2.last)
+        chain2.done = True
+        # both had a main line - chain2 still gets handed out for its
+        # own, but its references now belong to chain1 only
+        chain2.references = []
+        return chain1
+
+    def touch(self, chain, row):
+        chain.last = row
+        if self.window is not None:
+            heapq.heappush(self.expiry, (row, id(chain), chain))
+
+    # add reference line of row, with its own id and the id it
+    # references (which may be empty)
+    def addReference(self, row, line_id, ref_id, line):
+        if ref_id:
+            chain = self.union(line_id, ref_id)
+        else:
+            chain = self.chain(line_id)[1]
+        chain.references.append((row, line))
+        self.touch(chain, row)
+
+    # add main line of row, with its id. entry is handed back as
+    # chain.main once the chain is complete
+    def addMain(self, row, line_id, entry):
+        chain = self.chain(line_id)[1]
+        if chain.main is not None:
+            # same id twice - the first one's chain ends here
+            self.complete(chain)
+            chain = self.chain(line_id)[1]
+        chain.main = entry
+        self.queue.append(chain)
+        self.touch(chain, row)
+
+    # forget about complete chain's ids, and queue it if it has no
+    # main line (otherwise it's already in there)
+    def complete(self, chain):
+        chain.done = True
+        del self.chains[self.find(chain.ids[0])]
+        for node in chain.ids:
+            del self.parent[node]
+        if chain.main is None:
+            self.queue.append(chain)
+
+    def release(self):
+        released = []
+        while self.queue and self.queue[0].done:
+            released.append(self.queue.popleft())
+        return released
+
+    # call once row was added. Returns chains now complete, in order
+    def advance(self, row):
+        if self.window is None:
+            return []
+        while self.expiry and self.expiry[0][0] <= row - self.window:
+            last, key, chain = heapq.heappop(self.expiry)
+            if not chain.done and chain.last == last:
+                self.complete(chain)
+        return self.release()
+
+    # end of file - returns all remaining chains, in order
+    def flush(self):
+        for chain in sorted(self.chains.values(), key=lambda chain: chain.last):
+            self.complete(chain)
+        self.expiry = []
+        return self.release()
+
+    def __len__(self):
+        return len(self.parent)
@@ -0,0 +1,145 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+# Declarative rule files, for the many plugin snippets that only map a
+# key to two accounts plus memo and description templates. One ini
+# section per rule, e.g.:
+#
+#   [donations]
+#   type_and_state = DonationsCompleted
+#   account1       = PayPal
+#   account2       = Donations
+#   memo1          = Donation: %(name)s
+#   memo2          = PayPal: %(name)s [%(transaction_id)s]
+#   description    = PayPal:Donations %(name)s - ID: %(transaction_id)s
+#
+# The key option names the importer the rule is for, exactly like in
+# plugin snippets (type_and_state, desc_method_brand, type_curr).
+# Append _regex to match the key by regular expression instead, e.g.
+# "type_and_state_regex = Donations.*". PayPal rules may also just set
+# one of the merge_nextline, store_fwdref or ignore flags. Templates
+# use %(field)s for the fields of the importer's CSV lines.
+
+import re
+from ConfigParser import RawConfigParser, Error as ConfigError
+
+import plugins
+
+# suffix of the option matching the key by regex
+REGEX_SUFFIX = '_regex'
+
+class RuleTable:
+    '''Dispatch table of plugin handlers and compiled rules. Exact keys
+       are one dict lookup, regex rules are folded into one alternation
+       whose named group tells the rule, and the outcome is cached per
+       key - so classifying a row costs the same for any number of rules.
+       Folding shifts group numbers and spreads inline flags like (?i)
+       to all rules, so with any regex referring back to a numbered
+       group or setting flags, rules are tried one by one instead
+    '''
+    def __init__(self, exact, patterns):
+        self.exact = exact
+        self.handlers = [handler for regex, handler in patterns]
+        self.matcher = None
+        self.matchers = None
+        if [regex for regex, handler in patterns if re.search(r'\\[1-9]|\(\?\(\d|\(\?[iLmsux]', regex)]:
+            self.matchers = [re.compile(r'(?:%s)\Z' % regex) for regex, handler in patterns]
+        elif patterns:
+            self.matcher = re.compile(r'(?:%s)\Z' % '|'.join(
+                ['(?P<rule%d>%s)' % (index, regex) for index, (regex, handler) in enumerate(patterns)]))
+        self.cache = {}
+
+    # handler of the first regex rule matching key, or None
+    def _match(self, key):
+        if self.matchers is not None:
+            for index, matcher in enumerate(self.matchers):
+                if matcher.match(key):
+                    return self.handlers[index]
+            return None
+        match = self.matcher.match(key)
+        return self.handlers[int(match.lastgroup[4:])] if match else None
+
+    def get(self, key, default=None):
+        handler = self.exact.get(key)
+        if handler is None and self.handlers:
+            if key not in self.cache:
+                self.cache[key] = self._match(key)
+            handler = self.cache[key]
+        return default if handler is None else handler
+
+    # all handlers, exact ones first
+    def values(self):
+        return self.exact.values() + self.handlers
+
+    def __len__(self):
+        return len(self.exact) + len(self.handlers)
+
+# make plugins.Handler from one rule section
+def ruleHandler(config, section, key, fields, ruleImporter, account_index):
+    options = dict(config.items(section))
+    flags = {}
+    for flag in plugins.FLAGS:
+        if flag in options:
+            flags[flag] = config.getboolean(section, flag)
+    if True in flags.values():
+        if key in plugins.ACCOUNT_KEYS:
+            raise plugins.PluginError('Rule %s: %s is for PayPal rules only' % (section, ', '.join(flags)))
+        return plugins.Handler(section, None, **flags)
+
+    for option in ('account1', 'account2', 'description'):
+        if option not in options:
+            raise plugins.PluginError('Rule %s lacks %s' % (section, option))
+    templates = (options.get('memo1', ''), options.get('memo2', ''), options['description'])
+
+    # try templates on dummy values, to catch typos up front
+    dummy = dict.fromkeys(fields, 0)
+    for template in templates:
+        try:
+            template % dummy
+        except KeyError as e:
+            raise plugins.PluginError('Rule %s: unknown field %s in "%s"' % (section, e, template))
+        except (ValueError, TypeError) as e:
+            raise plugins.PluginError('Rule %s: malformed template "%s" (%s)' % (section, template, e))
+
+    return plugins.Handler(section, ruleImporter(options['account1'], options['account2'], *templates),
+                           account_index, options['account1'], options['account2'], **flags)
+
+# read rule files and compile the rules for importer key into one
+# RuleTable, together with the already loaded plugin handlers (which
+# cover the cases too complex for a rule). fields are the template
+# fields the importer offers, ruleImporter(account1_name,
+# account2_name, memo1, memo2, description) makes its importer
+# function. Bails out on broken rules.
+def loadRules(rulefiles, key, fields, ruleImporter, account_index, handlers=None):
+    exact = dict(handlers or {})
+    patterns = []
+    try:
+        config = RawConfigParser()
+        for rulefile in rulefiles or []:
+            if not config.read(rulefile):
+                raise plugins.PluginError('Cannot read rule file %s' % rulefile)
+
+        for section in config.sections():
+            if config.has_option(section, key):
+                value = config.get(section, key)
+                if value in exact:
+                    raise plugins.PluginError('Rule %s: %s "%s" is already handled by %s' % (section, key, value, exact[value].name))
+                exact[value] = ruleHandler(config, section, key, fields, ruleImporter, account_index)
+            elif config.has_option(section, key + REGEX_SUFFIX):
+                regex = config.get(section, key + REGEX_SUFFIX)
+                try:
+                    if re.compile(regex).groupindex:
+                        raise plugins.PluginError('Rule %s: named groups are not supported in "%s"' % (section, regex))
+                except re.error as e:
+                    raise plugins.PluginError('Rule %s: malformed regex "%s" (%s)' % (section, regex, e))
+                patterns.append((regex, ruleHandler(config, section, key, fields, ruleImporter, account_index)))
+    except (plugins.PluginError, ConfigError, ValueError) as e:
+        print "%s, bailing out!" % str(e).strip()
+        exit(1)
+
+    return RuleTable(exact, patterns)
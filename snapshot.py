@@ -0,0 +1,70 @@
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import os, sys, marshal, hashlib
+import ledger
+from gncreader import digestFile
+
+# Snapshots of compact ledger books (see ledger.py), for chained runs:
+# a script writing a ledger saves the book it has in memory alongside,
+# and the next one reading that ledger loads the snapshot instead of
+# parsing the xml. Snapshots live as sidecar files in ~/.cache/pygnclib,
+# one per ledger path, and are keyed by the ledger's content hash - any
+# change to the file, or to the format below, makes them stale, and
+# callers fall back to parsing.
+
+# bump whenever ledger's toState / fromState change
+FORMAT = 3
+
+def _cacheDir():
+    return os.getenv('HOME', default='') + '/.cache/pygnclib'
+
+def _sidecar(gncfile):
+    return _cacheDir() + '/book-' + hashlib.sha1(os.path.abspath(gncfile)).hexdigest() + '.snap'
+
+# first line of a snapshot. marshal's format differs between Python
+# versions, so that's part of the key, too
+def _stamp(gncfile):
+    return "%d %d.%d %s\n" % (FORMAT, sys.version_info[0], sys.version_info[1], digestFile(gncfile))
+
+# return book snapshotted for gncfile, if current and holding all of
+# kinds (None meaning everything) - None otherwise
+def load(gncfile, kinds=None, verbosity=0):
+    sidecar = _sidecar(gncfile)
+    if not os.path.exists(sidecar):
+        return None
+    f = open(sidecar, 'rb')
+    try:
+        if f.readline() != _stamp(gncfile):
+            if verbosity > 0: print 'Snapshot of %s is stale' % gncfile
+            return None
+        book = ledger.Book.fromState(marshal.load(f))
+    except (EOFError, ValueError, TypeError) as e:
+        if verbosity > 0: print 'Ignoring broken snapshot of %s (%s)' % (gncfile, e)
+        return None
+    finally:
+        f.close()
+    if not book.holds(kinds):
+        if verbosity > 0: print 'Snapshot of %s only holds %s' % (gncfile, ', '.join(book.kinds))
+        return None
+    if verbosity > 0: print 'Loaded snapshot of %s' % gncfile
+    return book
+
+# save book as snapshot of gncfile, which needs to be written and
+# closed already
+def save(gncfile, book, verbosity=0):
+    path = _cacheDir()
+    if not os.path.exists(path):
+        os.makedirs(path)
+    sidecar = _sidecar(gncfile)
+    f = open(sidecar + '.tmp', 'wb')
+    f.write(_stamp(gncfile))
+    marshal.dump(book.toState(), f, 2)
+    f.close()
+    os.rename(sidecar + '.tmp', sidecar)
+    if verbosity > 0: print 'Saved snapshot of %s' % gncfile
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import unittest, pickle
+import csvinput
+from amount import Amount, parseFloat, parseAmounts, gnucashFromAmount, ENGLISH, GERMAN
+
+class AmountTest(unittest.TestCase):
+    def testColumn(self):
+        amounts = parseAmounts(['1,234.5', '-0.00', 'EUR -0.125', ''], ENGLISH)
+        self.assertEqual([amount.exact for amount in amounts], [(123450, 100), (0, 100), (-125, 1000), (0, 100)])
+        self.assertEqual(amounts, [parseFloat(text, ENGLISH) for text in ['1,234.5', '-0.00', 'EUR -0.125', '']])
+        self.assertEqual(str(amounts[1]), '-0.0')
+        self.assertEqual([amount.exact for amount in parseAmounts(['1.234,5'], GERMAN)], [(123450, 100)])
+        self.assertEqual(parseAmounts([]), [])
+
+    def testExactUntilComputedWith(self):
+        amount = parseFloat('0.125')
+        self.assertEqual(gnucashFromAmount(-amount), '-125/1000')
+        self.assertEqual(gnucashFromAmount(abs(-amount)), '125/1000')
+        self.assertEqual(gnucashFromAmount(amount * 1), '13/100')
+
+    # multiprocessing pickles with protocol 2
+    def testPickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            amount = pickle.loads(pickle.dumps(parseFloat('-1.5'), protocol))
+            self.assertTrue(isinstance(amount, Amount))
+            self.assertEqual((amount, amount.exact), (-1.5, (-150, 100)))
+
+    def testProcessPool(self):
+        rows = [(parseFloat('0.125'),)] * (csvinput.CHUNK_ROWS + 1)
+        parsed = csvinput.parseRows(tuple, rows, jobs=2)
+        self.assertEqual(len(parsed), len(rows))
+        self.assertEqual(parsed[-1][0].exact, (125, 1000))
+
+if __name__ == '__main__':
+    unittest.main()
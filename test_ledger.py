@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import unittest, marshal, re, StringIO
+import ledger
+
+# gnc-testdata.xml, with ts:ns in all timespecs (as older GnuCash
+# versions wrote them) and an empty pricedb
+def fixture():
+    xml = open('gnc-testdata.xml').read()
+    counter = iter(xrange(1, 1000))
+    xml = re.sub(r'(\s*)(<ts:date>[^<]*</ts:date>)', lambda match: '%s%s%s<ts:ns>%d</ts:ns>' % (
+        match.group(1), match.group(2), match.group(1), next(counter)), xml)
+    start = xml.index('<gnc:account')
+    return xml[:start] + '<gnc:pricedb version="1"/>\n' + xml[start:]
+
+def written(book):
+    out = StringIO.StringIO()
+    book.write(out)
+    return out.getvalue()
+
+class LedgerTest(unittest.TestCase):
+    def testRoundTrip(self):
+        book = ledger.Book.load(StringIO.StringIO(fixture()))
+        self.assertEqual(book.pricedb, ' version="1"')
+        self.assertTrue(book.transaction[0].posted_ns is not None)
+        self.assertTrue([split for txn in book.transaction for split in txn.splits if split.reconciled_ns is not None])
+
+        xml = written(book)
+        self.assertEqual(xml.count('<ts:ns>'), fixture().count('<ts:ns>'))
+        self.assertTrue('<gnc:pricedb version="1">' in xml)
+        self.assertEqual(ledger.Book.load(StringIO.StringIO(xml)).toState(), book.toState())
+
+    def testState(self):
+        book = ledger.Book.load(StringIO.StringIO(fixture()))
+        state = marshal.loads(marshal.dumps(book.toState(), 2))
+        self.assertEqual(written(ledger.Book.fromState(state)), written(book))
+
+if __name__ == '__main__':
+    unittest.main()
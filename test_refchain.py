@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+#
+# This file is part of the pygnclib project.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+
+import unittest
+from refchain import RefChains
+
+# (main, reference lines) of all chains handed out, in order
+def book(chains, rows):
+    booked = []
+    for row, kind, args in rows:
+        if kind == 'main':
+            chains.addMain(row, *args)
+        else:
+            chains.addReference(row, *args)
+        booked.extend([(chain.main, chain.lines()) for chain in chains.advance(row)])
+    booked.extend([(chain.main, chain.lines()) for chain in chains.flush()])
+    return booked
+
+class RefChainsTest(unittest.TestCase):
+    def testReferencesBeforeMain(self):
+        rows = [(0, 'ref', ('r1', 'A', 'conversion A')),
+                (1, 'main', ('A', 'main A')),
+                (2, 'ref', ('r2', 'r1', 'fee A'))]
+        for window in (None, 1, 10):
+            self.assertEqual(book(RefChains(window), rows), [('main A', ['conversion A', 'fee A'])])
+
+    def testMergingTwoMainChains(self):
+        # references of both chains show up before their main lines, and
+        # a late reference line joins both chains - every reference must
+        # be booked exactly once
+        rows = [(0, 'ref', ('r1', 'A', 'ref A')),
+                (1, 'ref', ('r2', 'B', 'ref B')),
+                (2, 'main', ('A', 'main A')),
+                (3, 'main', ('B', 'main B')),
+                (4, 'ref', ('r3', 'r2', 'ref B 2')),
+                (5, 'ref', ('r2', 'r1', 'ref A+B'))]
+        for window in (None, 10):
+            booked = book(RefChains(window), rows)
+            self.assertEqual([main for main, lines in booked], ['main A', 'main B'])
+            lines = [line for main, references in booked for line in references]
+            self.assertEqual(sorted(lines), ['ref A', 'ref A+B', 'ref B', 'ref B 2'])
+
+    def testWindowHandsOutInMainOrder(self):
+        rows = [(0, 'main', ('A', 'main A')),
+                (1, 'main', ('B', 'main B')),
+                (2, 'ref', ('r1', 'B', 'ref B')),
+                (5, 'ref', ('r2', 'A', 'late ref A'))]
+        self.assertEqual(book(RefChains(2), rows), [('main A', []), ('main B', ['ref B']), (None, ['late ref A'])])
+
+if __name__ == '__main__':
+    unittest.main()